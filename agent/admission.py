@@ -0,0 +1,154 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+from metrics import registry
+
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of waiting for a free LLM slot."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"LLM capacity exhausted ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """A queued request; woken through a threading.Event or an asyncio future."""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.admitted = False
+
+    def wake(self):
+        self.admitted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """Concurrency limit for outbound LLM calls with a bounded FIFO wait queue.
+
+    At most `max_concurrent` calls run at once, shared by threadpool and
+    event-loop callers. Up to `max_queue` more wait in arrival order for at most
+    `queue_timeout` seconds; anything beyond that is shed immediately with
+    `Overloaded`, which carries a Retry-After estimate.
+    """
+
+    def __init__(self, max_concurrent: int = 32, max_queue: int = 64, queue_timeout: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._queue: "deque[_Waiter]" = deque()
+        self._lock = threading.Lock()
+        # Moving average of how long a call holds its slot, for Retry-After.
+        self._hold_seconds = 1.0
+        self._admitted = registry.counter("llm_admitted_total")
+        self._shed = registry.counter("llm_shed_total")
+        self._timeouts = registry.counter("llm_queue_timeouts_total")
+        self._wait = registry.histogram("llm_queue_wait_ms", WAIT_BUCKETS_MS)
+        self._depth = registry.histogram("llm_queue_depth", DEPTH_BUCKETS)
+
+    def _retry_after(self) -> int:
+        backlog = len(self._queue) + 1
+        return max(1, math.ceil(self._hold_seconds * backlog / self.max_concurrent))
+
+    def _enter(self, waiter: _Waiter) -> bool:
+        """Take a slot or join the queue; True if admitted right away."""
+        with self._lock:
+            self._depth.observe(len(self._queue))
+            if self._active < self.max_concurrent and not self._queue:
+                self._active += 1
+                return True
+            if len(self._queue) >= self.max_queue:
+                self._shed.inc()
+                raise Overloaded("queue full", self._retry_after())
+            self._queue.append(waiter)
+            return False
+
+    def _abandon(self, waiter: _Waiter):
+        """Leave the queue after a timeout or cancellation, returning a slot granted meanwhile."""
+        with self._lock:
+            if not waiter.admitted:
+                self._queue.remove(waiter)
+                return
+        self._release()
+
+    def _release(self, held: Optional[float] = None):
+        with self._lock:
+            if held is not None:
+                self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held
+            if self._queue:
+                # Hand the slot straight to the oldest waiter.
+                self._queue.popleft().wake()
+            else:
+                self._active -= 1
+
+    def _admitted_after(self, started: float):
+        self._admitted.inc()
+        self._wait.observe((time.monotonic() - started) * 1000)
+
+    @contextmanager
+    def slot(self):
+        """Hold an LLM slot in a (threadpool) thread."""
+        started = time.monotonic()
+        waiter = _Waiter()
+        if not self._enter(waiter) and not waiter.event.wait(self.queue_timeout):
+            self._abandon(waiter)
+            self._timeouts.inc()
+            raise Overloaded("queue timeout", self._retry_after())
+        self._admitted_after(started)
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - acquired)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Hold an LLM slot from a coroutine."""
+        started = time.monotonic()
+        waiter = _Waiter(asyncio.get_running_loop())
+        if not self._enter(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._abandon(waiter)
+                self._timeouts.inc()
+                raise Overloaded("queue timeout", self._retry_after())
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+        self._admitted_after(started)
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - acquired)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": len(self._queue),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+            }
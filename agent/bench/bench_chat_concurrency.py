@@ -0,0 +1,120 @@
+"""Compare the sync /chat and async /chat/async handlers under concurrent slow LLM calls.
+
+The real model is replaced by an LLM that sleeps for a fixed latency, so the
+numbers only reflect how many calls a single agent process can keep in flight.
+
+    python bench/bench_chat_concurrency.py --requests 400 --latency 1.0
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from typing import Any, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("AGENT_RETRIEVAL", "0")
+# Admission control would cap both paths at the same limit; lift it to compare the handlers.
+os.environ.setdefault("AGENT_LLM_MAX_CONCURRENCY", "100000")
+
+import httpx
+from langchain_core.language_models.llms import LLM
+
+import main
+
+
+class SlowLLM(LLM):
+    """Answers after `latency` seconds and records the peak number of concurrent calls."""
+
+    latency: float = 1.0
+    in_flight: int = 0
+    peak: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _enter(self):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self._enter()
+        try:
+            time.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return "Rosuvastatin is taken once daily."
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return "Rosuvastatin is taken once daily."
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run(path: str, requests: int, latency: float) -> dict:
+    # Load everything first, so warmup does not replace the fake model afterwards.
+    main.warmup.wait()
+    main.llm = SlowLLM(latency=latency)
+    main.session_store = main.SessionStore(main.create_session)
+    transport = httpx.ASGITransport(app=main.app)
+    latencies: List[float] = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def one(i: int):
+            start = time.perf_counter()
+            # Distinct questions, so identical first turns are not coalesced into one call.
+            question = f"How do I take dose {i}?"
+            r = await client.post(path, json={"user_input": question, "session_id": f"bench-{i}"})
+            r.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        wall = time.perf_counter() - start
+
+    return {
+        "path": path,
+        "requests": requests,
+        "max_concurrent_llm_calls": main.llm.peak,
+        "wall_s": wall,
+        "p50_s": percentile(latencies, 50),
+        "p99_s": percentile(latencies, 99),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=1.0, help="simulated LLM latency in seconds")
+    args = parser.parse_args()
+
+    results = []
+    for path in ("/chat", "/chat/async"):
+        # The handlers and the verbose chain print every turn; keep the report readable.
+        with contextlib.redirect_stdout(io.StringIO()):
+            results.append(asyncio.run(run(path, args.requests, args.latency)))
+
+    print(f"{'path':<12} {'requests':>8} {'max conc.':>9} {'wall s':>8} {'p50 s':>8} {'p99 s':>8}")
+    for r in results:
+        print(
+            f"{r['path']:<12} {r['requests']:>8} {r['max_concurrent_llm_calls']:>9} "
+            f"{r['wall_s']:>8.2f} {r['p50_s']:>8.2f} {r['p99_s']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
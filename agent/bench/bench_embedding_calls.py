@@ -0,0 +1,92 @@
+"""Compare provider round trips of direct embedding calls with the cached, micro-batched embeddings.
+
+Concurrent workers embed questions drawn from a small pool, as users asking
+the same things would, against a fake provider with a fixed per-call latency.
+Directly, every question is one provider call; through CachedEmbeddings the
+misses of concurrent workers share calls and a repeated question costs none.
+A second cached run over the same cache directory shows a warm restart.
+
+    python bench/bench_embedding_calls.py --workers 32 --requests 2000 --latency-ms 40
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings
+
+
+class SlowEmbeddings(Embeddings):
+    def __init__(self, latency: float, dim: int):
+        self.latency = latency
+        self.dim = dim
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return [np.random.default_rng(zlib.crc32(text.encode())).random(self.dim).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def run(embeddings: Embeddings, questions: List[str], workers: int) -> List[float]:
+    def ask(question: str) -> float:
+        started = time.perf_counter()
+        embeddings.embed_query(question)
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(ask, questions))
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=300, help="size of the question pool")
+    parser.add_argument("--latency-ms", type=float, default=40)
+    parser.add_argument("--window-ms", type=float, default=10)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    questions = [f"Question {rng.randrange(args.distinct)} about rosuvastatin?" for _ in range(args.requests)]
+    directory = tempfile.mkdtemp(prefix="embedding-bench-")
+    print(f"{'mode':>12} {'provider calls':>15} {'p50 ms':>8} {'p99 ms':>8} {'wall s':>7}")
+    try:
+        for mode in ("direct", "cached cold", "cached warm"):
+            provider = SlowEmbeddings(args.latency_ms / 1000, args.dim)
+            embeddings = provider
+            if mode != "direct":
+                embeddings = CachedEmbeddings.in_directory(
+                    provider, "bench", directory, window=args.window_ms / 1000
+                )
+            started = time.perf_counter()
+            latencies = sorted(run(embeddings, questions, args.workers))
+            wall = time.perf_counter() - started
+            p50 = statistics.median(latencies)
+            p99 = latencies[int(len(latencies) * 0.99) - 1]
+            print(f"{mode:>12} {provider.calls:15d} {p50:8.1f} {p99:8.1f} {wall:7.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
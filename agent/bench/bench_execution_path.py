@@ -0,0 +1,113 @@
+"""Compare per-turn overhead and memory of the "chain" and "lean" execution paths.
+
+Each mode runs in its own process with the model replaced by one that answers
+instantly, so the timings are pure agent overhead: memory loading, prompt
+formatting and budgeting, the chain machinery and saving the turn. RSS is
+sampled after the agent has warmed up and after all turns have run.
+
+    python bench/bench_execution_path.py --sessions 200 --turns 5
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_child(sessions: int, turns: int) -> Dict:
+    started = time.perf_counter()
+    sys.path.insert(0, AGENT_DIR)
+    os.chdir(AGENT_DIR)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import main
+        from langchain_core.language_models.fake import FakeListLLM
+
+        import_seconds = time.perf_counter() - started
+        main.warmup.wait()
+        warmup_seconds = time.perf_counter() - started - import_seconds
+        rss_warm = rss_mb()
+        main.llm = FakeListLLM(responses=["Rosuvastatin is taken once daily."])
+        profile = {"first_name": "Ann", "age": 61, "diagnosis": "hyperlipidemia", "medicine": "Lipitor"}
+
+        latencies = []
+        for index in range(sessions):
+            session = main.create_session(f"bench:{index}")
+            main.insert_profile_into_memory(session, main.profile_registry.register(profile))
+            for turn in range(turns):
+                # Verbose chain output goes to stdout too, which is part of the cost.
+                t = time.perf_counter()
+                session.conversation.predict(input=f"Question {turn} about my medication?")
+                latencies.append(time.perf_counter() - t)
+    return {
+        "import_s": import_seconds,
+        "warmup_s": warmup_seconds,
+        "rss_warm_mb": rss_warm,
+        "rss_end_mb": rss_mb(),
+        "mean_us": sum(latencies) / len(latencies) * 1e6,
+        "p50_us": percentile(latencies, 50) * 1e6,
+        "p99_us": percentile(latencies, 99) * 1e6,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--child", choices=("chain", "lean"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.sessions, args.turns)))
+        return
+
+    results = {}
+    for mode in ("chain", "lean"):
+        env = dict(
+            os.environ,
+            AGENT_EXECUTION=mode,
+            AGENT_RETRIEVAL="0",
+            OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+        )
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", mode,
+             "--sessions", str(args.sessions), "--turns", str(args.turns)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{args.sessions} sessions x {args.turns} turns")
+    print(
+        f"{'mode':6} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} "
+        f"{'import s':>9} {'warmup s':>9} {'RSS warm':>11} {'RSS end':>9}"
+    )
+    for mode, r in results.items():
+        print(
+            f"{mode:6} {r['mean_us']:9.0f} {r['p50_us']:9.0f} {r['p99_us']:9.0f} "
+            f"{r['import_s']:9.2f} {r['warmup_s']:9.2f} {r['rss_warm_mb']:9.1f}MB {r['rss_end_mb']:7.1f}MB"
+        )
+    chain, lean = results["chain"], results["lean"]
+    print(
+        f"lean saves {chain['mean_us'] - lean['mean_us']:.0f} us per turn "
+        f"({1 - lean['mean_us'] / chain['mean_us']:.0%}) and "
+        f"{chain['rss_end_mb'] - lean['rss_end_mb']:.1f} MB RSS"
+    )
+
+
+if __name__ == "__main__":
+    main_cli()
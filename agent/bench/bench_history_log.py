@@ -0,0 +1,72 @@
+"""Measure how opening the on-disk history log scales with the number of stored sessions.
+
+For each size the log is filled with `--turns` turns per session and closed
+cleanly, then reopened. Opening only maps the shard indexes, so it should stay
+flat; the first read of a session costs a few index lookups and frame reads.
+The full replay column is what restoring every session at boot would cost.
+
+    python bench/bench_history_log.py --sessions 1000 10000 100000 --turns 4
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from history_log import LogHistory
+
+
+def turn(index: int):
+    return {
+        "type": "messages",
+        "messages": [
+            {"type": "human", "data": {"content": f"Question {index} about my medication?"}},
+            {"type": "ai", "data": {"content": "Rosuvastatin is taken once daily, with or without food."}},
+        ],
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--reads", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>9} {'log MB':>8} {'open ms':>9} {'first read ms':>14} {'full replay s':>14}")
+    for sessions in args.sessions:
+        directory = tempfile.mkdtemp(prefix="history-bench-")
+        try:
+            history = LogHistory(directory, shards=args.shards, fsync=False, compact_bytes=1 << 40)
+            for index in range(sessions):
+                history.append(f"session:{index}", [{"type": "profile", "profile": {"user_id": index}}])
+                history.append(f"session:{index}", [turn(t) for t in range(args.turns)])
+            size_mb = history.stats()["bytes"] / (1024 * 1024)
+            history.close()
+
+            started = time.perf_counter()
+            history = LogHistory(directory, shards=args.shards, fsync=False, compact_bytes=1 << 40)
+            open_ms = (time.perf_counter() - started) * 1000
+
+            sample = random.sample(range(sessions), min(args.reads, sessions))
+            started = time.perf_counter()
+            for index in sample:
+                history.read({f"session:{index}": 0})
+            read_ms = (time.perf_counter() - started) * 1000 / len(sample)
+
+            started = time.perf_counter()
+            history.read({f"session:{index}": 0 for index in range(sessions)})
+            replay_s = time.perf_counter() - started
+            history.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        print(f"{sessions:9d} {size_mb:8.1f} {open_ms:9.2f} {read_ms:14.3f} {replay_s:14.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,103 @@
+"""Recall of lexical, vector and hybrid label retrieval on a small labeled question set.
+
+Each question in bench/label_questions.json lists the terms a relevant chunk
+contains; a question is recalled at k when one of the top k chunks contains all
+of them. The vector and hybrid modes embed with OpenAI and search Milvus
+(a fresh Milvus Lite file by default), so they need OPENAI_API_KEY; `--lexical-only`
+skips them.
+
+    python bench/bench_retrieval_recall.py --pdf crestor_eng.pdf --k 4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Sequence
+
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pdf_cache import load_pages
+from retrieval import LabelRetriever
+
+QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "label_questions.json")
+
+
+def is_relevant(document: Document, terms: Sequence[str]) -> bool:
+    text = document.page_content.casefold()
+    return all(term.casefold() in text for term in terms)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def evaluate(search: Callable[[str, int], List[Document]], questions: List[Dict], k: int) -> Dict:
+    """Recall@k, mean reciprocal rank and latency of `search` over the questions."""
+    hits, reciprocal_ranks, latencies = 0, 0.0, []
+    for question in questions:
+        started = time.perf_counter()
+        documents = search(question["question"], k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        for rank, document in enumerate(documents, start=1):
+            if is_relevant(document, question["relevant"]):
+                hits += 1
+                reciprocal_ranks += 1 / rank
+                break
+    return {
+        "recall": hits / len(questions),
+        "mrr": reciprocal_ranks / len(questions),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", default="crestor_eng.pdf")
+    parser.add_argument("--questions", default=QUESTIONS)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--milvus-uri", help="defaults to a Milvus Lite file in a new temporary directory")
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    parser.add_argument("--lexical-only", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = json.load(f)
+    pages = load_pages(args.pdf)
+    answerable = [q for q in questions if any(is_relevant(Document(page_content=p), q["relevant"]) for p in pages)]
+    print(f"{len(pages)} pages, {len(answerable)} of {len(questions)} questions answerable from {args.pdf}")
+
+    embeddings = None
+    if not args.lexical_only:
+        from langchain_openai import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings(model=args.embedding_model)
+    retriever = LabelRetriever(
+        args.milvus_uri or os.path.join(tempfile.mkdtemp(prefix="recall-bench-"), "milvus.db"),
+        "recall_bench",
+        embeddings,
+        source=os.path.basename(args.pdf),
+        pages_loader=lambda: pages,
+        k=args.k,
+        hybrid=True,
+        candidates=args.candidates,
+    )
+    modes = {"lexical": retriever.lexical_search}
+    if not args.lexical_only:
+        retriever.connect()
+        modes.update(vector=retriever.vector_search, hybrid=retriever.search)
+
+    print(f"{'mode':8} {'recall@' + str(args.k):>9} {'MRR':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, search in modes.items():
+        r = evaluate(search, answerable, args.k)
+        print(f"{mode:8} {r['recall']:9.2f} {r['mrr']:6.2f} {r['p50_ms']:8.2f} {r['p99_ms']:8.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,68 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+# Words, numbers with decimals, and mixed tokens such as "hba1c" or "40mg".
+TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+DOSE = re.compile(r"^(\d+(?:\.\d+)?)([a-z]+)$")
+UNITS = frozenset({"mg", "mcg", "g", "kg", "ml", "l", "dl", "mmol", "umol", "iu", "units", "min", "h", "hours"})
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its me my of on or should "
+    "that the their them this to was what when which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; a number followed by a unit also yields the joined term ("40 mg" -> "40mg")."""
+    tokens = [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+    terms = list(tokens)
+    for token, following in zip(tokens, tokens[1:]):
+        if token[0].isdigit() and following in UNITS:
+            terms.append(token + following)
+    for token in tokens:
+        match = DOSE.match(token)
+        if match and match.group(2) in UNITS:
+            terms.extend(match.groups())
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of documents, with an inverted index of term postings."""
+
+    def __init__(self, documents: Sequence[Document], k1: float = 1.2, b: float = 0.75):
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._lengths: List[int] = []
+        for position, document in enumerate(self.documents):
+            terms = Counter(tokenize(document.page_content))
+            self._lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, []).append((position, frequency))
+        count = len(self.documents)
+        self._average_length = sum(self._lengths) / count if count else 0.0
+        self._idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[position] / self._average_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.documents[position], score) for position, score in best]
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from starlette.requests import Request
+
+from metrics import registry
+
+disconnects = registry.counter("client_disconnects_total")
+cancelled_calls = registry.counter("llm_calls_cancelled_total")
+# Tokens already generated when a call was aborted; everything after them was saved.
+cancelled_tokens = registry.counter("llm_cancelled_tokens_total")
+
+
+class ClientDisconnected(Exception):
+    """The client went away, so the turn was abandoned before it finished."""
+
+
+class CancellationHandler(BaseCallbackHandler):
+    """Aborts a chain run from inside its callbacks once `event` is set.
+
+    The run is checked when the chain starts (after memory and retrieval were
+    loaded), when the model call starts and after every streamed token. Because
+    the chain only saves to memory after the model returns, an aborted turn leaves
+    the session's memory untouched.
+    """
+
+    raise_error = True
+
+    def __init__(self, event: Optional[threading.Event] = None):
+        self.event = event or threading.Event()
+        self.tokens = 0
+
+    def check(self):
+        if self.event.is_set():
+            cancelled_calls.inc()
+            cancelled_tokens.inc(self.tokens)
+            raise ClientDisconnected()
+
+    def on_chain_start(self, serialized, inputs, **kwargs: Any) -> None:
+        self.check()
+
+    def on_llm_start(self, serialized, prompts, **kwargs: Any) -> None:
+        self.check()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.tokens += 1
+        self.check()
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    awaitable: Awaitable,
+    on_disconnect: Optional[Callable[[], None]] = None,
+    poll_interval: float = 0.1,
+) -> Any:
+    """Await `awaitable`, polling `request` for a client disconnect meanwhile.
+
+    On a disconnect `on_disconnect` is called if given (to signal work running
+    in a thread, which cannot be cancelled from outside) and the task is awaited
+    to finish; otherwise the task itself is cancelled. Raises ClientDisconnected.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                break
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+    disconnects.inc()
+    if on_disconnect is not None:
+        on_disconnect()
+    else:
+        task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, ClientDisconnected):
+        pass
+    raise ClientDisconnected()
@@ -0,0 +1,302 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import registry
+
+KEY_SIZE = 16
+
+hits = registry.counter("embedding_cache_hits_total")
+misses = registry.counter("embedding_cache_misses_total")
+provider_calls = registry.counter("embedding_provider_calls_total")
+provider_texts = registry.counter("embedding_provider_texts_total")
+batch_sizes = registry.histogram("embedding_batch_size", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+provider_ms = registry.histogram("embedding_provider_ms")
+
+
+def text_key(namespace: str, text: str) -> bytes:
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).digest()[:KEY_SIZE]
+
+
+class EmbeddingStore:
+    """Append-only on-disk map of content hash -> vector, shared by all processes using the directory.
+
+    Vectors are rows of `dtype` in one file, read through a memory map; their
+    keys are 16-byte hashes in a parallel file, loaded into a dict on open, and
+    the row of a key is its position in that file. A vector is written (and
+    fsynced) before its key, a failed append cuts both files back, and on open
+    both are cut back to the rows they both hold, so a key never points at a
+    missing or foreign vector. Appends are serialized between processes by flock;
+    keys appended by another process are picked up on a miss.
+    """
+
+    def __init__(self, directory: str, dtype: str = "float16"):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        os.makedirs(directory, exist_ok=True)
+        self._keys_path = os.path.join(directory, f"keys.{self.dtype.name}")
+        self._vectors_path = os.path.join(directory, f"vectors.{self.dtype.name}")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock_path = os.path.join(directory, "LOCK")
+        self._index: Dict[bytes, int] = {}
+        self._keys_read = 0
+        self._map: Optional[mmap.mmap] = None
+        self._mapped_rows = 0
+        self._lock = threading.Lock()
+        self.dim = self._read_dim()
+        with self._file_lock():
+            self._repair()
+        self._load_new_keys()
+
+    def _read_dim(self) -> Optional[int]:
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)["dim"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    def _repair(self):
+        keys_size = os.path.getsize(self._keys_path) if os.path.exists(self._keys_path) else 0
+        vectors_size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        # Without meta.json the row size is unknown, so nothing stored can be read.
+        rows = min(keys_size // KEY_SIZE, vectors_size // self._row_bytes()) if self.dim else 0
+        row_bytes = self._row_bytes() if self.dim else 0
+        for path, size in ((self._keys_path, rows * KEY_SIZE), (self._vectors_path, rows * row_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                print(f"Truncating {path} to {size} bytes after an interrupted write.")
+                os.truncate(path, size)
+
+    def _load_new_keys(self):
+        """Index keys appended since the last call, by this or another process."""
+        try:
+            with open(self._keys_path, "rb") as f:
+                f.seek(self._keys_read)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        data = data[: len(data) // KEY_SIZE * KEY_SIZE]
+        row = self._keys_read // KEY_SIZE
+        for offset in range(0, len(data), KEY_SIZE):
+            self._index.setdefault(data[offset : offset + KEY_SIZE], row)
+            row += 1
+        self._keys_read += len(data)
+        if self.dim is None and self._index:
+            self.dim = self._read_dim()
+
+    def _vector(self, row: int) -> np.ndarray:
+        if row >= self._mapped_rows:
+            if self._map is not None:
+                self._map.close()
+            with open(self._vectors_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_rows = len(self._map) // self._row_bytes()
+        return np.frombuffer(self._map, dtype=self.dtype, count=self.dim, offset=row * self._row_bytes())
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, List[float]]:
+        with self._lock:
+            if any(key not in self._index for key in keys):
+                self._load_new_keys()
+            return {
+                key: self._vector(self._index[key]).astype(np.float32).tolist()
+                for key in keys
+                if key in self._index
+            }
+
+    def put_many(self, items: Dict[bytes, Sequence[float]]) -> Dict[bytes, List[float]]:
+        """Store the vectors; return them as they will be read back (in `dtype` precision)."""
+        stored = {key: np.asarray(vector, dtype=self.dtype) for key, vector in items.items()}
+        with self._lock, self._file_lock():
+            self._load_new_keys()
+            new = [key for key in stored if key not in self._index]
+            if new:
+                if self.dim is None:
+                    self.dim = len(stored[new[0]])
+                    with open(self._meta_path, "w") as f:
+                        json.dump({"dim": self.dim}, f)
+                # A key's row is its position in the keys file. Rows beyond the
+                # last key are left over from a failed append and are overwritten.
+                start_row = self._keys_read // KEY_SIZE
+                try:
+                    with open(self._vectors_path, "ab") as f:
+                        f.truncate(start_row * self._row_bytes())
+                        f.write(b"".join(stored[key].tobytes() for key in new))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    with open(self._keys_path, "ab") as f:
+                        f.truncate(start_row * KEY_SIZE)
+                        f.write(b"".join(new))
+                except BaseException:
+                    # Cut both files back, so no key is ever paired with another's vector.
+                    sizes = {self._keys_path: start_row * KEY_SIZE, self._vectors_path: start_row * self._row_bytes()}
+                    for path, size in sizes.items():
+                        try:
+                            os.truncate(path, size)
+                        except OSError:
+                            pass
+                    raise
+                for row, key in enumerate(new, start_row):
+                    self._index[key] = row
+                self._keys_read += len(new) * KEY_SIZE
+        return {key: vector.astype(np.float32).tolist() for key, vector in stored.items()}
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._index), "dim": self.dim, "dtype": self.dtype.name}
+
+
+class MicroBatcher:
+    """Merges the texts of concurrent callers into shared provider calls.
+
+    The first caller waits `window` seconds for others to join, then sends every
+    pending text in calls of at most `max_batch`. A text already pending or in
+    flight is not sent again; its callers share the result.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]], window: float = 0.01, max_batch: int = 256):
+        self.embed = embed
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[str, Future] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self._collecting = False
+        self._lock = threading.Lock()
+
+    def __call__(self, texts: Sequence[str]) -> List[List[float]]:
+        futures = []
+        with self._lock:
+            for text in texts:
+                future = self._pending.get(text) or self._in_flight.get(text)
+                if future is None:
+                    future = self._pending[text] = Future()
+                futures.append(future)
+            lead = bool(self._pending) and not self._collecting
+            if lead:
+                self._collecting = True
+        if lead:
+            if self.window > 0:
+                time.sleep(self.window)
+            self._flush()
+        return [future.result() for future in futures]
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._in_flight.update(pending)
+            self._collecting = False
+        texts = list(pending)
+        try:
+            for start in range(0, len(texts), self.max_batch):
+                batch = texts[start : start + self.max_batch]
+                try:
+                    vectors = self.embed(batch)
+                except Exception as e:
+                    for text in batch:
+                        pending[text].set_exception(e)
+                    continue
+                for text, vector in zip(batch, vectors):
+                    pending[text].set_result(vector)
+        finally:
+            with self._lock:
+                for text in texts:
+                    self._in_flight.pop(text, None)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that are looked up by content hash before calling the provider.
+
+    Misses of concurrent requests are micro-batched into shared provider calls
+    and written to `store`, so a chunk or question is embedded once, ever.
+    `namespace` (the model name) keeps vectors of different models apart. With
+    `symmetric` (true for OpenAI), queries and documents share their vectors.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        namespace: str,
+        store: Optional[EmbeddingStore] = None,
+        window: float = 0.01,
+        max_batch: int = 256,
+        symmetric: bool = True,
+    ):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.store = store
+        self.symmetric = symmetric
+        self._documents = MicroBatcher(self._provider(embeddings.embed_documents, "document"), window, max_batch)
+        self._queries = (
+            self._documents
+            if symmetric
+            else MicroBatcher(self._provider(self._embed_queries, "query"), window, max_batch)
+        )
+
+    @classmethod
+    def in_directory(cls, embeddings: Embeddings, namespace: str, directory: str, dtype: str = "float16", **kwargs):
+        """Cache in a subdirectory of `directory` named after the namespace."""
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", namespace)
+        return cls(embeddings, namespace, EmbeddingStore(os.path.join(directory, slug), dtype), **kwargs)
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    def _provider(self, embed: Callable[[List[str]], List[List[float]]], kind: str):
+        def call(texts: List[str]) -> List[List[float]]:
+            provider_calls.inc()
+            provider_texts.inc(len(texts))
+            batch_sizes.observe(len(texts))
+            started = time.perf_counter()
+            vectors = embed(texts)
+            provider_ms.observe((time.perf_counter() - started) * 1000)
+            if self.store is None:
+                return vectors
+            stored = self.store.put_many({self._key(text, kind): vector for text, vector in zip(texts, vectors)})
+            return [stored[self._key(text, kind)] for text in texts]
+
+        return call
+
+    def _key(self, text: str, kind: str) -> bytes:
+        return text_key(self.namespace if self.symmetric else f"{self.namespace}:{kind}", text)
+
+    def _embed(self, texts: List[str], kind: str, batcher: MicroBatcher) -> List[List[float]]:
+        cached = self.store.get_many([self._key(text, kind) for text in texts]) if self.store is not None else {}
+        missing = list(dict.fromkeys(text for text in texts if self._key(text, kind) not in cached))
+        hits.inc(len(texts) - len(missing))
+        misses.inc(len(missing))
+        if missing:
+            for text, vector in zip(missing, batcher(missing)):
+                cached[self._key(text, kind)] = vector
+        return [cached[self._key(text, kind)] for text in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts), "document", self._documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query", self._queries)[0]
+
+    def stats(self) -> Dict:
+        return self.store.stats() if self.store is not None else {}
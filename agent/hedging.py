@@ -0,0 +1,255 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from llm_transport import AbortScope
+from metrics import registry
+
+TTFT_BUCKETS_MS = (50, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 30000)
+
+_DONE = object()
+
+
+class Hedger:
+    """Decides when to send a duplicate (hedge) request and keeps the hedge rate in budget.
+
+    The hedge delay is the `percentile` of recently observed time-to-first-token,
+    clamped to [min_delay, max_delay]; until `min_samples` calls have been seen
+    it is `max_delay`. At most `budget` of the last `window` calls may be hedged.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        min_delay: float = 0.25,
+        max_delay: float = 5.0,
+        budget: float = 0.1,
+        window: int = 500,
+        min_samples: int = 20,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.min_samples = min_samples
+        self._ttft: "deque[float]" = deque(maxlen=window)
+        self._hedged: "deque[bool]" = deque(maxlen=window)
+        # Hedges issued but not recorded yet, so concurrent calls cannot overshoot the budget.
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._requests = registry.counter("llm_hedge_requests_total")
+        self._hedges = registry.counter("llm_hedges_total")
+        self._wins = registry.counter("llm_hedge_wins_total")
+        self._denied = registry.counter("llm_hedges_over_budget_total")
+        self._ttft_ms = registry.histogram("llm_ttft_ms", TTFT_BUCKETS_MS)
+        self._hedged_ttft_ms = registry.histogram("llm_hedged_ttft_ms", TTFT_BUCKETS_MS)
+
+    def delay(self) -> float:
+        with self._lock:
+            samples = sorted(self._ttft)
+        if len(samples) < self.min_samples:
+            return self.max_delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return min(self.max_delay, max(self.min_delay, samples[index]))
+
+    def allow_hedge(self) -> bool:
+        with self._lock:
+            calls = len(self._hedged) + 1
+            allowed = sum(self._hedged) + self._pending + 1 <= self.budget * calls
+            if allowed:
+                self._pending += 1
+        if allowed:
+            self._hedges.inc()
+        else:
+            self._denied.inc()
+        return allowed
+
+    def record(self, ttft: float, hedged: bool, hedge_won: bool):
+        """Record a finished call; `ttft` is measured from the first request's start."""
+        self._requests.inc()
+        if hedge_won:
+            self._wins.inc()
+        with self._lock:
+            if hedged:
+                self._pending -= 1
+            self._hedged.append(hedged)
+            # The TTFT of the primary alone is what the delay percentile should track.
+            if not hedge_won:
+                self._ttft.append(ttft)
+        (self._hedged_ttft_ms if hedged else self._ttft_ms).observe(ttft * 1000)
+
+    def discard(self, hedged: bool):
+        """Forget a call that failed or was abandoned before its first token."""
+        if hedged:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hedged = sum(self._hedged)
+            calls = len(self._hedged)
+        return {
+            "delay_s": self.delay(),
+            "recent_calls": calls,
+            "recent_hedge_rate": hedged / calls if calls else 0.0,
+        }
+
+
+class HedgedLLM(LLM):
+    """LLM wrapper that streams from `llm` and hedges calls whose first token is late.
+
+    If no token has arrived after `hedger.delay()` seconds (and the hedge budget
+    allows), the same prompt is sent again; whichever attempt produces a token
+    first is used and the other one is cancelled. Every call path, including
+    `predict` through a chain, goes through streaming so the first token can be
+    observed.
+    """
+
+    llm: Any
+    hedger: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged"
+
+    @property
+    def model_name(self) -> str:
+        return self.llm.model_name
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.llm.get_num_tokens(text)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        return "".join([chunk.text async for chunk in self._astream(prompt, stop, run_manager, **kwargs)])
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        chunks: "queue.Queue" = queue.Queue()
+        # Aborting an attempt's scope shuts down its connection, so a loser that
+        # has not sent a token yet stops at once instead of at the read timeout.
+        scopes = [AbortScope(), AbortScope()]
+
+        def pump(attempt: int):
+            try:
+                with scopes[attempt]:
+                    for text in self.llm.stream(prompt, stop=stop, **kwargs):
+                        if scopes[attempt].aborted:
+                            return
+                        chunks.put((attempt, text))
+                chunks.put((attempt, _DONE))
+            except Exception as e:
+                chunks.put((attempt, e))
+
+        started = time.monotonic()
+        threading.Thread(target=pump, args=(0,), daemon=True).start()
+        attempts, failures, winner = 1, 0, None
+        # Until the hedge is sent or refused; after that, wait for the first token.
+        deadline: Optional[float] = started + self.hedger.delay()
+        try:
+            while winner is None:
+                timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+                try:
+                    attempt, item = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    deadline = None
+                    if self.hedger.allow_hedge():
+                        attempts = 2
+                        threading.Thread(target=pump, args=(1,), daemon=True).start()
+                    continue
+                if isinstance(item, Exception):
+                    failures += 1
+                    if failures >= attempts:
+                        raise item
+                    continue
+                winner = attempt
+                scopes[1 - winner].abort()
+                self.hedger.record(time.monotonic() - started, attempts == 2, winner == 1)
+                if item is _DONE:
+                    return
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(item)
+                yield GenerationChunk(text=item)
+
+            while True:
+                attempt, item = chunks.get()
+                if attempt != winner:
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(item)
+                yield GenerationChunk(text=item)
+        finally:
+            # Also stops both attempts when the consumer gives up on the stream.
+            for scope in scopes:
+                scope.abort()
+            if winner is None:
+                self.hedger.discard(attempts == 2)
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        chunks: "asyncio.Queue" = asyncio.Queue()
+
+        async def pump(attempt: int):
+            try:
+                async for text in self.llm.astream(prompt, stop=stop, **kwargs):
+                    await chunks.put((attempt, text))
+                await chunks.put((attempt, _DONE))
+            except Exception as e:
+                await chunks.put((attempt, e))
+
+        started = time.monotonic()
+        tasks = [asyncio.ensure_future(pump(0))]
+        failures, winner = 0, None
+        delay: Optional[float] = self.hedger.delay()
+        try:
+            while winner is None:
+                try:
+                    attempt, item = await asyncio.wait_for(chunks.get(), delay)
+                except asyncio.TimeoutError:
+                    delay = None
+                    if self.hedger.allow_hedge():
+                        tasks.append(asyncio.ensure_future(pump(1)))
+                    continue
+                if isinstance(item, Exception):
+                    failures += 1
+                    if failures >= len(tasks):
+                        raise item
+                    continue
+                winner = attempt
+                # Cancelling the losing task aborts its HTTP request.
+                for index, task in enumerate(tasks):
+                    if index != winner:
+                        task.cancel()
+                self.hedger.record(time.monotonic() - started, len(tasks) == 2, winner == 1)
+                if item is _DONE:
+                    return
+                if run_manager is not None:
+                    await run_manager.on_llm_new_token(item)
+                yield GenerationChunk(text=item)
+
+            while True:
+                attempt, item = await chunks.get()
+                if attempt != winner:
+                    continue
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if run_manager is not None:
+                    await run_manager.on_llm_new_token(item)
+                yield GenerationChunk(text=item)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if winner is None:
+                self.hedger.discard(len(tasks) == 2)
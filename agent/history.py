@@ -0,0 +1,334 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from metrics import registry
+
+# A history is an append-only log of records per session, numbered from 1:
+#   {"type": "messages", "messages": [...]}  turns saved to memory
+#   {"type": "clear"}                         everything before it is dropped
+#   {"type": "profile", "profile": {...}}     the profile the history belongs to
+#   {"type": "fold", "messages": [n, ...], "summary": "..."}
+#                                             messages folded into the rolling summary
+#   {"type": "snapshot", ...}                 the state of all records before it, see snapshot()
+Record = Tuple[int, Dict]
+
+reads = registry.counter("history_reads_total")
+read_batches = registry.counter("history_read_batches_total")
+appends = registry.counter("history_appends_total")
+read_ms = registry.histogram("history_read_ms")
+append_ms = registry.histogram("history_append_ms")
+
+
+def snapshot(records: Sequence[Dict]) -> Dict:
+    """Collapse a session's records into one record that replays to the same state."""
+    messages: List[Dict] = []
+    numbers: List[int] = []
+    next_number = 0
+    summary = ""
+    profile = None
+    for record in records:
+        kind = record["type"]
+        if kind == "messages":
+            for message in record["messages"]:
+                next_number += 1
+                messages.append(message)
+                numbers.append(next_number)
+        elif kind == "clear":
+            messages, numbers, summary, profile = [], [], "", None
+        elif kind == "profile":
+            profile = record["profile"]
+        elif kind == "fold":
+            folded = set(record["messages"])
+            kept = [(n, m) for n, m in zip(numbers, messages) if n not in folded]
+            numbers, messages = [n for n, _ in kept], [m for _, m in kept]
+            summary = record["summary"]
+        elif kind == "snapshot":
+            messages, numbers = list(record["messages"]), list(record["numbers"])
+            next_number, summary, profile = record["next_number"], record["summary"], record["profile"]
+    return {
+        "type": "snapshot",
+        "messages": messages,
+        "numbers": numbers,
+        "next_number": next_number,
+        "summary": summary,
+        "profile": profile,
+    }
+
+
+class HistoryBackend(ABC):
+    """Storage of the per-session record logs, shared by every worker."""
+
+    @abstractmethod
+    def read(self, after: Dict[str, int]) -> Dict[str, List[Record]]:
+        """Records of each session numbered above `after[session_id]`, in order, in one round trip."""
+
+    @abstractmethod
+    def append(self, session_id: str, records: Sequence[Dict]) -> int:
+        """Append `records` to the session's log and return the number of the last one."""
+
+    def stats(self) -> Dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+class InMemoryHistory(HistoryBackend):
+    """Process-local backend, for tests and single-worker runs."""
+
+    def __init__(self):
+        self._logs: Dict[str, List[Dict]] = {}
+        self._lock = threading.Lock()
+
+    def read(self, after: Dict[str, int]) -> Dict[str, List[Record]]:
+        with self._lock:
+            return {
+                session_id: [
+                    (seq, json.loads(record))
+                    for seq, record in enumerate(self._logs.get(session_id, [])[start:], start + 1)
+                ]
+                for session_id, start in after.items()
+            }
+
+    def append(self, session_id: str, records: Sequence[Dict]) -> int:
+        # Stored serialized, like a real database, so callers cannot share mutable state.
+        with self._lock:
+            log = self._logs.setdefault(session_id, [])
+            log.extend(json.dumps(record) for record in records)
+            return len(log)
+
+
+class PostgresHistory(HistoryBackend):
+    """Backend in a Postgres table keyed by (session_id, seq).
+
+    Each append numbers its records after the session's highest committed
+    number; two workers appending to the same session at once collide on the
+    primary key and the loser retries. Numbers are therefore gapless and a
+    reader that has seen record n never misses a record below it.
+    """
+
+    def __init__(self, dsn: Dict, table: str = "agent_chat_history", max_connections: int = 10):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.table = table
+        self._pool = ThreadedConnectionPool(1, max_connections, **dsn)
+        with self._connection() as cursor:
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    session_id TEXT NOT NULL,
+                    seq BIGINT NOT NULL,
+                    record JSONB NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (session_id, seq)
+                )
+                """
+            )
+
+    def _connection(self):
+        pool = self._pool
+
+        class Checkout:
+            def __enter__(self):
+                self.conn = pool.getconn()
+                self.conn.autocommit = True
+                return self.conn.cursor()
+
+            def __exit__(self, exc_type, exc, tb):
+                # A connection that failed mid-statement may be broken; do not reuse it.
+                pool.putconn(self.conn, close=exc_type is not None and self.conn.closed != 0)
+
+        return Checkout()
+
+    def read(self, after: Dict[str, int]) -> Dict[str, List[Record]]:
+        result: Dict[str, List[Record]] = {session_id: [] for session_id in after}
+        with self._connection() as cursor:
+            cursor.execute(
+                f"""
+                SELECT h.session_id, h.seq, h.record
+                FROM {self.table} h
+                JOIN unnest(%s::text[], %s::bigint[]) AS w(session_id, after)
+                  ON h.session_id = w.session_id AND h.seq > w.after
+                ORDER BY h.session_id, h.seq
+                """,
+                (list(after), list(after.values())),
+            )
+            for session_id, seq, record in cursor.fetchall():
+                result[session_id].append((seq, record))
+        return result
+
+    def append(self, session_id: str, records: Sequence[Dict], attempts: int = 5) -> int:
+        from psycopg2 import errors
+
+        for attempt in range(attempts):
+            try:
+                with self._connection() as cursor:
+                    cursor.execute(
+                        f"""
+                        INSERT INTO {self.table} (session_id, seq, record)
+                        SELECT %s, last.seq + r.ord, r.record
+                        FROM (SELECT COALESCE(MAX(seq), 0) AS seq FROM {self.table} WHERE session_id = %s) last,
+                             unnest(%s::jsonb[]) WITH ORDINALITY AS r(record, ord)
+                        RETURNING seq
+                        """,
+                        (session_id, session_id, [json.dumps(record) for record in records]),
+                    )
+                    return max(row[0] for row in cursor.fetchall())
+            except errors.UniqueViolation:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.005 * (attempt + 1))
+
+    def close(self):
+        self._pool.closeall()
+
+
+class BatchedReader:
+    """Coalesces the history reads of concurrent turns into one backend query.
+
+    The first reader waits `window` seconds for others to join, then reads every
+    pending session in a single round trip and hands each caller its records.
+    """
+
+    def __init__(self, backend: HistoryBackend, window: float = 0.002):
+        self.backend = backend
+        self.window = window
+        self._pending: Dict[str, Tuple[int, List[Tuple[int, Future]]]] = {}
+        self._collecting = False
+        self._lock = threading.Lock()
+
+    def read(self, session_id: str, after: int) -> List[Record]:
+        future: Future = Future()
+        with self._lock:
+            start, waiters = self._pending.get(session_id, (after, []))
+            waiters.append((after, future))
+            self._pending[session_id] = (min(start, after), waiters)
+            lead = not self._collecting
+            self._collecting = True
+        if lead:
+            if self.window > 0:
+                time.sleep(self.window)
+            self._flush()
+        return future.result()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._collecting = False
+        reads.inc(len(pending))
+        read_batches.inc()
+        started = time.perf_counter()
+        try:
+            logs = self.backend.read({session_id: start for session_id, (start, _) in pending.items()})
+        except Exception as e:
+            for _, waiters in pending.values():
+                for _, future in waiters:
+                    future.set_exception(e)
+            return
+        read_ms.observe((time.perf_counter() - started) * 1000)
+        for session_id, (_, waiters) in pending.items():
+            for after, future in waiters:
+                future.set_result([record for record in logs.get(session_id, []) if record[0] > after])
+
+
+class StoredChatHistory(BaseChatMessageHistory):
+    """Chat history of one session, kept in a shared backend.
+
+    The messages in memory are a replay of the session's log up to `seq`;
+    `refresh` applies the records other workers appended since. Every change is
+    appended to the log, never rewritten, so any worker can serve the next turn.
+    """
+
+    def __init__(self, session_id: str, backend: HistoryBackend, reader: Optional[BatchedReader] = None):
+        self.session_id = session_id
+        self.backend = backend
+        self.reader = reader
+        self.seq = 0
+        self.messages: List[BaseMessage] = []
+        # Message numbers, parallel to `messages`, that fold records refer to.
+        self._numbers: List[int] = []
+        self._next_number = 0
+        self.summary = ""
+        self.profile: Optional[Dict] = None
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        with self._lock:
+            if self.reader is not None:
+                records = self.reader.read(self.session_id, self.seq)
+            else:
+                records = self.backend.read({self.session_id: self.seq})[self.session_id]
+            for seq, record in records:
+                self._apply(record)
+                self.seq = seq
+
+    def _apply(self, record: Dict):
+        kind = record["type"]
+        if kind == "messages":
+            for message in messages_from_dict(record["messages"]):
+                self._next_number += 1
+                self.messages.append(message)
+                self._numbers.append(self._next_number)
+        elif kind == "clear":
+            self.messages, self._numbers = [], []
+            self.summary = ""
+            self.profile = None
+        elif kind == "profile":
+            self.profile = record["profile"]
+        elif kind == "fold":
+            folded = set(record["messages"])
+            kept = [(n, m) for n, m in zip(self._numbers, self.messages) if n not in folded]
+            self._numbers = [n for n, _ in kept]
+            self.messages = [m for _, m in kept]
+            self.summary = record["summary"]
+        elif kind == "snapshot":
+            self.messages = messages_from_dict(record["messages"])
+            self._numbers = list(record["numbers"])
+            self._next_number = record["next_number"]
+            self.summary = record["summary"]
+            self.profile = record["profile"]
+
+    def _append(self, records: List[Dict]):
+        with self._lock:
+            # Catch up first, so local message numbers match the log's.
+            self.refresh()
+            previous = self.seq
+            started = time.perf_counter()
+            seq = self.backend.append(self.session_id, records)
+            append_ms.observe((time.perf_counter() - started) * 1000)
+            appends.inc()
+            if seq == previous + len(records):
+                for record in records:
+                    self._apply(record)
+            else:
+                # Another worker appended between the refresh and the insert. Replay
+                # the log from where this replica stopped, or their records would
+                # never be read: `seq` is already past them.
+                for number, record in self.backend.read({self.session_id: previous})[self.session_id]:
+                    if number > seq:
+                        break
+                    self._apply(record)
+            self.seq = seq
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self._append([{"type": "messages", "messages": [message_to_dict(m) for m in messages]}])
+
+    def clear(self) -> None:
+        self._append([{"type": "clear"}])
+
+    def set_profile(self, profile: Dict):
+        self._append([{"type": "profile", "profile": profile}])
+
+    def fold(self, messages: Sequence[BaseMessage], summary: str):
+        """Replace `messages` by `summary`, for the rolling summary memory."""
+        with self._lock:
+            folded = {id(message) for message in messages}
+            numbers = [n for n, m in zip(self._numbers, self.messages) if id(m) in folded]
+            self._append([{"type": "fold", "messages": numbers, "summary": summary}])
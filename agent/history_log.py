@@ -0,0 +1,398 @@
+import fcntl
+import glob
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from history import HistoryBackend, Record, snapshot
+from metrics import registry
+
+# Log frame: body length and CRC32 of the body, then the JSON body
+# {"s": session_id, "n": seq, "r": record}. A frame that is cut short or fails
+# its checksum marks the end of what was durably written.
+FRAME = struct.Struct("<II")
+# Index file: magic, the log length it covers and its number of entries, then
+# (session key, frame offset) entries sorted by key and offset.
+INDEX_HEADER = struct.Struct("<8sQQ")
+INDEX_ENTRY = struct.Struct("<QQ")
+INDEX_MAGIC = b"AGIDX001"
+
+compactions = registry.counter("history_log_compactions_total")
+checkpoints = registry.counter("history_log_index_checkpoints_total")
+truncations = registry.counter("history_log_torn_writes_total")
+open_ms = registry.histogram("history_log_open_ms")
+
+
+def session_key(session_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomically(path: str, chunks: Iterator[bytes]):
+    """Write a whole file under a temporary name, fsync it and move it into place."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_directory(os.path.dirname(path))
+
+
+class _Shard:
+    """One append-only log file with its memory-mapped offset index.
+
+    Offsets of frames appended since the index was written are kept in `_tail`;
+    the index is rewritten (a checkpoint) once the tail holds
+    `checkpoint_entries` frames, so opening the shard only scans that much of
+    the log. Compaction rewrites the log as one snapshot frame per session into
+    the next generation of files.
+    """
+
+    def __init__(self, prefix: str, fsync: bool, checkpoint_entries: int, compact_bytes: int):
+        self.prefix = prefix
+        self.fsync = fsync
+        self.checkpoint_entries = checkpoint_entries
+        self.compact_bytes = compact_bytes
+        self.lock = threading.Lock()
+        self.compacting = False
+        self._index: Optional[mmap.mmap] = None
+        self._index_entries = 0
+        self._tail: Dict[int, List[int]] = {}
+        self._tail_entries = 0
+        self._last_seq: Dict[str, int] = {}
+
+        generations = sorted(int(path.rsplit(".", 2)[1]) for path in glob.glob(glob.escape(prefix) + ".*.log"))
+        self.generation = generations[-1] if generations else 0
+        for path in glob.glob(glob.escape(prefix) + ".*"):
+            # Files of a compaction that crashed: the older generation if it had
+            # finished, the unfinished newer one if it had not.
+            if path.endswith(".tmp") or int(path.split(".")[-2]) != self.generation:
+                os.remove(path)
+        self._log = open(self._path("log"), "a+b")
+        covered = self._map_index()
+        self.size = self._recover(covered)
+        self.compacted_size = self.size
+        if self._tail_entries >= self.checkpoint_entries or (covered == 0 and self._tail_entries):
+            self.checkpoint()
+
+    def _path(self, kind: str, generation: Optional[int] = None) -> str:
+        return f"{self.prefix}.{self.generation if generation is None else generation}.{kind}"
+
+    # --- index ---------------------------------------------------------------
+
+    def _map_index(self) -> int:
+        """Map the index file; return the log length it covers (0 if it is missing or invalid)."""
+        if self._index is not None:
+            self._index.close()
+            self._index, self._index_entries = None, 0
+        try:
+            with open(self._path("idx"), "rb") as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return 0
+        magic, covered, entries = INDEX_HEADER.unpack_from(index, 0) if len(index) >= INDEX_HEADER.size else (b"", 0, 0)
+        log_size = os.fstat(self._log.fileno()).st_size
+        if magic != INDEX_MAGIC or len(index) != INDEX_HEADER.size + entries * INDEX_ENTRY.size or covered > log_size:
+            print(f"Ignoring invalid history index {self._path('idx')}; rebuilding it from the log.")
+            index.close()
+            return 0
+        self._index, self._index_entries = index, entries
+        return covered
+
+    def _indexed_offsets(self, key: int) -> List[int]:
+        index, low, high = self._index, 0, self._index_entries
+        if index is None:
+            return []
+        while low < high:
+            middle = (low + high) // 2
+            if INDEX_ENTRY.unpack_from(index, INDEX_HEADER.size + middle * INDEX_ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        offsets = []
+        for position in range(low, self._index_entries):
+            entry_key, offset = INDEX_ENTRY.unpack_from(index, INDEX_HEADER.size + position * INDEX_ENTRY.size)
+            if entry_key != key:
+                break
+            offsets.append(offset)
+        return offsets
+
+    def _index_chunks(self, entries: List[Tuple[int, int]], covered: Optional[int] = None) -> Iterator[bytes]:
+        yield INDEX_HEADER.pack(INDEX_MAGIC, self.size if covered is None else covered, len(entries))
+        for start in range(0, len(entries), 4096):
+            yield b"".join(INDEX_ENTRY.pack(*entry) for entry in entries[start : start + 4096])
+
+    def checkpoint(self):
+        """Write the tail into the index file, so the next open does not scan it."""
+        # The index must never cover frames that are not on disk yet.
+        os.fsync(self._log.fileno())
+        entries = list(INDEX_ENTRY.iter_unpack(self._index[INDEX_HEADER.size :])) if self._index is not None else []
+        entries.extend((key, offset) for key, offsets in self._tail.items() for offset in offsets)
+        entries.sort()
+        _write_atomically(self._path("idx"), self._index_chunks(entries))
+        self._map_index()
+        self._tail, self._tail_entries = {}, 0
+        checkpoints.inc()
+
+    # --- log -----------------------------------------------------------------
+
+    def _recover(self, start: int) -> int:
+        """Index the frames after `start` and cut off a torn write at the end; return the log size."""
+        self._log.seek(start)
+        data = self._log.read()
+        position = 0
+        while position + FRAME.size <= len(data):
+            length, checksum = FRAME.unpack_from(data, position)
+            body = data[position + FRAME.size : position + FRAME.size + length]
+            if len(body) < length or zlib.crc32(body) != checksum:
+                break
+            self._add_to_tail(json.loads(body)["s"], start + position)
+            position += FRAME.size + length
+        if position < len(data):
+            print(f"Truncating {len(data) - position} bytes of a torn write at the end of {self._path('log')}.")
+            truncations.inc()
+            self._log.truncate(start + position)
+            os.fsync(self._log.fileno())
+        return start + position
+
+    def _add_to_tail(self, session_id: str, offset: int):
+        self._tail.setdefault(session_key(session_id), []).append(offset)
+        self._tail_entries += 1
+
+    def _read_frame(self, offset: int) -> Dict:
+        length, _ = FRAME.unpack(os.pread(self._log.fileno(), FRAME.size, offset))
+        return json.loads(os.pread(self._log.fileno(), length, offset + FRAME.size))
+
+    def _frames_newest_first(self, session_id: str) -> Iterator[Dict]:
+        key = session_key(session_id)
+        offsets = self._indexed_offsets(key) + self._tail.get(key, [])
+        for offset in reversed(offsets):
+            frame = self._read_frame(offset)
+            # Keys are hashes; skip frames of other sessions that share one.
+            if frame["s"] == session_id:
+                yield frame
+
+    def read(self, session_id: str, after: int) -> List[Record]:
+        records = []
+        for frame in self._frames_newest_first(session_id):
+            self._last_seq.setdefault(session_id, frame["n"])
+            if frame["n"] <= after:
+                break
+            records.append((frame["n"], frame["r"]))
+        records.reverse()
+        return records
+
+    def last_seq(self, session_id: str) -> int:
+        if session_id not in self._last_seq:
+            frame = next(self._frames_newest_first(session_id), None)
+            self._last_seq[session_id] = frame["n"] if frame is not None else 0
+        return self._last_seq[session_id]
+
+    def append(self, session_id: str, records: Sequence[Dict]) -> int:
+        seq = self.last_seq(session_id)
+        frames = []
+        offset = self.size
+        for record in records:
+            seq += 1
+            body = json.dumps({"s": session_id, "n": seq, "r": record}).encode("utf-8")
+            frames.append(FRAME.pack(len(body), zlib.crc32(body)) + body)
+            self._add_to_tail(session_id, offset)
+            offset += len(frames[-1])
+        self._log.write(b"".join(frames))
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self.size = offset
+        self._last_seq[session_id] = seq
+        if self._tail_entries >= self.checkpoint_entries:
+            self.checkpoint()
+        return seq
+
+    def needs_compaction(self) -> bool:
+        return not self.compacting and self.size > max(self.compact_bytes, 2 * self.compacted_size)
+
+    def _parse_frames(self, data: bytes, start: int) -> Iterator[Tuple[int, Dict]]:
+        """(offset, frame) of every frame in `data`, which was read from the log at `start`."""
+        position = 0
+        while position < len(data):
+            length, _ = FRAME.unpack_from(data, position)
+            yield start + position, json.loads(data[position + FRAME.size : position + FRAME.size + length])
+            position += FRAME.size + length
+
+    def compact(self):
+        """Rewrite the log as one snapshot frame per session, in the next generation of files.
+
+        The log is append-only, so everything up to its current end is rewritten
+        without holding `lock`; reads and appends go on against the old files.
+        The lock is only taken again to copy the frames appended meanwhile and
+        to switch to the new files.
+        """
+        with self.lock:
+            log, end = self._log, self.size
+            new_generation = self.generation + 1
+        data = os.pread(log.fileno(), end, 0)
+        sessions: Dict[str, List[Dict]] = {}
+        last_seq: Dict[str, int] = {}
+        for _, frame in self._parse_frames(data, 0):
+            sessions.setdefault(frame["s"], []).append(frame["r"])
+            last_seq[frame["s"]] = frame["n"]
+        del data
+
+        chunks: List[bytes] = []
+        entries: List[Tuple[int, int]] = []
+        offset = 0
+        for session_id, records in sessions.items():
+            # The snapshot keeps the number of the session's last record, so readers
+            # that have seen it get nothing new and the others replay the snapshot.
+            body = json.dumps({"s": session_id, "n": last_seq[session_id], "r": snapshot(records)}).encode("utf-8")
+            chunks.append(FRAME.pack(len(body), zlib.crc32(body)) + body)
+            entries.append((session_key(session_id), offset))
+            offset += len(chunks[-1])
+        entries.sort()
+        compacted = offset
+        # The new log stays under a temporary name until the frames appended
+        # meanwhile are copied into it; a crash before that leaves the old
+        # generation in charge and the new files are discarded on open.
+        tmp_log = self._path("log", new_generation) + ".tmp"
+        with open(tmp_log, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        del chunks
+        _write_atomically(
+            self._path("idx", new_generation),
+            self._index_chunks(entries, covered=compacted),
+        )
+
+        with self.lock:
+            tail = os.pread(log.fileno(), self.size - end, end)
+            with open(tmp_log, "ab") as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_log, self._path("log", new_generation))
+            _fsync_directory(os.path.dirname(tmp_log))
+            old_generation = self.generation
+            self.generation = new_generation
+            self._log.close()
+            self._log = open(self._path("log"), "a+b")
+            self._map_index()
+            self._tail, self._tail_entries = {}, 0
+            for frame_offset, frame in self._parse_frames(tail, compacted):
+                self._add_to_tail(frame["s"], frame_offset)
+            self.size = compacted + len(tail)
+            self.compacted_size = self.size
+            for kind in ("log", "idx"):
+                try:
+                    os.remove(self._path(kind, old_generation))
+                except FileNotFoundError:
+                    pass
+        compactions.inc()
+
+    def close(self):
+        if self._tail_entries:
+            self.checkpoint()
+        if self._index is not None:
+            self._index.close()
+        self._log.close()
+
+
+class LogHistory(HistoryBackend):
+    """Histories in append-only log files on local disk, for single-node deployments.
+
+    Sessions are spread over `shards` logs by a hash of their id. Nothing is
+    replayed on open: a session's frames are found through the shard's index
+    on first access. A shard is compacted in the background once its log has
+    doubled since the last compaction (and is over `compact_bytes`). With
+    `fsync`, an append is on disk when it returns. The directory is locked, so
+    only one process (a single uvicorn worker) may use it at a time.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        shards: int = 16,
+        fsync: bool = True,
+        compact_bytes: int = 64 * 1024 * 1024,
+        checkpoint_entries: int = 10000,
+    ):
+        started = time.perf_counter()
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, "LOCK"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"History directory {self.directory} is in use by another process.")
+        self._shards = [
+            _Shard(
+                os.path.join(self.directory, f"shard-{number:03d}"),
+                fsync=fsync,
+                checkpoint_entries=checkpoint_entries,
+                compact_bytes=compact_bytes,
+            )
+            for number in range(shards)
+        ]
+        open_ms.observe((time.perf_counter() - started) * 1000)
+
+    def _shard(self, session_id: str) -> _Shard:
+        return self._shards[session_key(session_id) % len(self._shards)]
+
+    def read(self, after: Dict[str, int]) -> Dict[str, List[Record]]:
+        result = {}
+        for session_id, start in after.items():
+            shard = self._shard(session_id)
+            with shard.lock:
+                result[session_id] = shard.read(session_id, start)
+        return result
+
+    def append(self, session_id: str, records: Sequence[Dict]) -> int:
+        shard = self._shard(session_id)
+        with shard.lock:
+            seq = shard.append(session_id, records)
+            compact = shard.needs_compaction()
+            if compact:
+                shard.compacting = True
+        if compact:
+            threading.Thread(target=self._compact, args=(shard,), name="history-compaction", daemon=True).start()
+        return seq
+
+    def _compact(self, shard: _Shard):
+        started = time.perf_counter()
+        try:
+            before = shard.size
+            shard.compact()
+            print(f"Compacted {shard.prefix} from {before} to {shard.size} bytes in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            print(f"Error compacting {shard.prefix}: {e}")
+        finally:
+            shard.compacting = False
+
+    def stats(self) -> Dict:
+        return {
+            "directory": self.directory,
+            "shards": len(self._shards),
+            "bytes": sum(shard.size for shard in self._shards),
+            "unindexed_frames": sum(shard._tail_entries for shard in self._shards),
+        }
+
+    def close(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.close()
+        self._lock_file.close()
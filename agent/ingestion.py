@@ -0,0 +1,257 @@
+"""Incremental, change-detecting ingestion of drug-label PDFs into Milvus.
+
+A chunk's id hashes its source and text, so the ids a label should have can
+be compared with the ids the collection already holds: only new or changed
+chunks are embedded and inserted, and chunks whose text is gone are deleted.
+Chunks that only moved to another page, because a page was inserted or removed
+before them, keep their id and just get their page rewritten. A manifest
+records the text hash of every ingested document, so an unchanged document is
+skipped without asking Milvus at all.
+
+    python ingestion.py crestor_eng.pdf labels/ --prune
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from metrics import registry
+from retrieval import chunk_id, chunk_pages
+
+# 2: chunk ids no longer include the page, so collections of version 1 are re-synced once.
+MANIFEST_VERSION = 2
+
+chunks_added = registry.counter("ingest_chunks_added_total")
+chunks_deleted = registry.counter("ingest_chunks_deleted_total")
+chunks_moved = registry.counter("ingest_chunks_moved_total")
+documents_skipped = registry.counter("ingest_documents_unchanged_total")
+
+
+class SyncResult(NamedTuple):
+    source: str
+    added: int
+    deleted: int
+    unchanged: int
+    skipped: bool
+    moved: int = 0
+
+
+def pages_sha256(pages: Sequence[str]) -> str:
+    """Hash of a document's extracted text; it changes exactly when its chunks can."""
+    return hashlib.sha256(json.dumps(list(pages)).encode("utf-8")).hexdigest()
+
+
+def source_filter(source: str) -> str:
+    return f"source == {json.dumps(source)}"
+
+
+def read_manifest(path: str) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get("version") == MANIFEST_VERSION else {}
+
+
+def write_manifest(path: str, manifest: Dict):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so a crash never leaves half a manifest.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class LabelIngestor:
+    """Keeps a Milvus collection in sync with a set of documents, one source at a time.
+
+    The collection is the source of truth: which chunks to add and delete is
+    decided from the ids it holds, and a lost manifest only costs one query per
+    document. Milvus is written first and the manifest last, so an interrupted
+    run is simply redone by the next one.
+    """
+
+    def __init__(
+        self,
+        store,
+        manifest_path: Optional[str],
+        uri: Optional[str] = None,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 150,
+        delete_batch: int = 1000,
+    ):
+        self.store = store
+        self.manifest_path = manifest_path
+        self.uri = uri
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.delete_batch = delete_batch
+        self.manifest = read_manifest(manifest_path) if manifest_path else {}
+        settings = self._settings()
+        if any(self.manifest.get(key) != value for key, value in settings.items()):
+            # Another collection, Milvus or chunking: nothing in it can be trusted.
+            self.manifest = dict(settings, version=MANIFEST_VERSION, documents={})
+
+    def _settings(self) -> Dict:
+        return {
+            "milvus_uri": self.uri,
+            "collection": self.store.collection_name,
+            "chunking": [self.chunk_size, self.chunk_overlap],
+        }
+
+    def _collection_empty(self) -> bool:
+        return self.store.col is None or self.store.col.num_entities == 0
+
+    def _delete(self, ids: List[str]):
+        for start in range(0, len(ids), self.delete_batch):
+            self.store.delete(ids=ids[start : start + self.delete_batch])
+
+    def _locations(self, source: str) -> Dict[str, Tuple]:
+        """(page, chunk) of every chunk of `source` in the collection, by id."""
+        if self.store.col is None:
+            return {}
+        # A query without limit returns at most 16384 rows, plenty for one label.
+        rows = self.store.client.query(
+            self.store.collection_name,
+            filter=source_filter(source),
+            output_fields=[self.store._primary_field, "page", "chunk"],
+        )
+        return {row[self.store._primary_field]: (row.get("page"), row.get("chunk")) for row in rows}
+
+    def sync(self, source: str, pages: Sequence[str], force: bool = False) -> SyncResult:
+        """Bring the chunks of `source` in the collection up to date with `pages`."""
+        digest = pages_sha256(pages)
+        entry = self.manifest["documents"].get(source)
+        if not force and entry is not None and entry["sha256"] == digest and not self._collection_empty():
+            documents_skipped.inc()
+            return SyncResult(source, 0, 0, entry["chunks"], True)
+
+        desired: Dict[str, Document] = {}
+        for chunk in chunk_pages(pages, source, self.chunk_size, self.chunk_overlap):
+            # A chunk repeated verbatim is stored once, cited by its first page.
+            desired.setdefault(chunk_id(chunk), chunk)
+        existing = self._locations(source)
+        stale = [pk for pk in existing if pk not in desired]
+        new = [pk for pk in desired if pk not in existing]
+        moved = [
+            pk
+            for pk, location in existing.items()
+            if pk in desired and location != (desired[pk].metadata["page"], desired[pk].metadata["chunk"])
+        ]
+
+        if stale:
+            self._delete(stale)
+        if new:
+            self.store.add_documents([desired[pk] for pk in new], ids=new)
+        if moved:
+            # Re-embedding an unchanged text is a hit in the embedding cache.
+            self.store.upsert(ids=moved, documents=[desired[pk] for pk in moved])
+        chunks_deleted.inc(len(stale))
+        chunks_added.inc(len(new))
+        chunks_moved.inc(len(moved))
+        self.manifest["documents"][source] = {
+            "sha256": digest,
+            "pages": len(pages),
+            "chunks": len(desired),
+            "ingested_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        self._save()
+        return SyncResult(source, len(new), len(stale), len(desired) - len(new) - len(moved), False, len(moved))
+
+    def remove(self, source: str) -> int:
+        """Delete every chunk of a document that is no longer part of the corpus."""
+        ids = self.store.get_pks(source_filter(source)) or []
+        self._delete(ids)
+        chunks_deleted.inc(len(ids))
+        self.manifest["documents"].pop(source, None)
+        self._save()
+        return len(ids)
+
+    def sources(self) -> List[str]:
+        return sorted(self.manifest["documents"])
+
+    def _save(self):
+        if self.manifest_path:
+            write_manifest(self.manifest_path, self.manifest)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import pdf_cache
+    import pdf_extract
+    from langchain_milvus import Milvus
+    from langchain_openai import OpenAIEmbeddings
+
+    parser = argparse.ArgumentParser(description="Ingest label PDFs into Milvus, embedding only what changed.")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories")
+    parser.add_argument("--milvus-uri", default=os.getenv("MILVUS_URI", "http://localhost:19530"))
+    parser.add_argument("--collection", default=os.getenv("AGENT_LABEL_COLLECTION", "crestor_label"))
+    parser.add_argument("--embedding-model", default=os.getenv("AGENT_EMBEDDING_MODEL", "text-embedding-3-small"))
+    parser.add_argument("--manifest", default=None, help="default: <pdf cache dir>/ingest-<collection>.json")
+    parser.add_argument("--prune", action="store_true", help="delete documents in the manifest that were not given")
+    parser.add_argument("--force", action="store_true", help="compare with Milvus even if the manifest says unchanged")
+    parser.add_argument("--embedding-cache", default=os.getenv("AGENT_EMBEDDING_CACHE_DIR", ".embedding_cache"))
+    parser.add_argument("--no-embedding-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    embeddings = OpenAIEmbeddings(model=args.embedding_model)
+    if not args.no_embedding_cache:
+        from embedding_cache import CachedEmbeddings
+
+        embeddings = CachedEmbeddings.in_directory(
+            embeddings,
+            args.embedding_model,
+            args.embedding_cache,
+            dtype=os.getenv("AGENT_EMBEDDING_CACHE_DTYPE", "float16"),
+        )
+    store = Milvus(
+        embedding_function=embeddings,
+        collection_name=args.collection,
+        connection_args={"uri": args.milvus_uri},
+        auto_id=False,
+    )
+    ingestor = LabelIngestor(
+        store,
+        args.manifest or os.path.join(pdf_cache.CACHE_DIR, f"ingest-{args.collection}.json"),
+        uri=args.milvus_uri,
+    )
+    status = 0
+    seen = set()
+    for path in pdf_extract.find_pdfs(args.paths):
+        source = os.path.basename(path)
+        seen.add(source)
+        start = time.perf_counter()
+        try:
+            result = ingestor.sync(source, pdf_cache.load_pages(path), force=args.force)
+        except Exception as e:
+            print(f"{path}: {e}")
+            status = 1
+            continue
+        elapsed = (time.perf_counter() - start) * 1000
+        if result.skipped:
+            print(f"{source}: unchanged ({result.unchanged} chunks), {elapsed:.0f} ms")
+        else:
+            print(
+                f"{source}: {result.added} chunks added, {result.deleted} deleted, {result.moved} moved, "
+                f"{result.unchanged} unchanged in {elapsed:.0f} ms"
+            )
+    if args.prune and status == 0:
+        for source in ingestor.sources():
+            if source not in seen:
+                print(f"{source}: removed, {ingestor.remove(source)} chunks deleted")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.memory import BaseMemory
+from langchain_core.messages import AIMessage, HumanMessage, get_buffer_string
+from langchain_core.prompts import BasePromptTemplate
+from pydantic import Field
+
+
+class BufferMemory(BaseMemory):
+    """ConversationBufferMemory on langchain_core alone, for the lean path.
+
+    Importing `langchain.memory` imports langchain's chain machinery with it,
+    which is what the lean path leaves out. Same variables, same saved messages.
+    """
+
+    chat_memory: BaseChatMessageHistory = Field(default_factory=InMemoryChatMessageHistory)
+    input_key: Optional[str] = None
+    output_key: Optional[str] = None
+    return_messages: bool = False
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    memory_key: str = "history"
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def buffer(self) -> Any:
+        messages = self.chat_memory.messages
+        if self.return_messages:
+            return messages
+        return get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return {self.memory_key: self.buffer}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_key = self.input_key or next(key for key in inputs if key not in self.memory_variables and key != "stop")
+        output_key = self.output_key or ("output" if "output" in outputs else next(iter(outputs)))
+        self.chat_memory.add_messages([HumanMessage(content=inputs[input_key]), AIMessage(content=outputs[output_key])])
+
+    def clear(self) -> None:
+        self.chat_memory.clear()
+
+
+class LeanConversation:
+    """Stand-in for ConversationChain that does only what the agent needs from it.
+
+    It loads the memory variables, formats the prompt, calls the model and saves
+    the turn to every memory, exactly like ConversationChain with a
+    CombinedMemory, but without the chain's callback runs, input validation and
+    verbose printing of every prompt. Callbacks passed to `predict` still reach
+    the model call.
+    """
+
+    def __init__(
+        self,
+        llm,
+        prompt: BasePromptTemplate,
+        memories: Sequence[BaseMemory],
+        input_key: str = "input",
+        output_key: str = "response",
+    ):
+        self.llm = llm
+        self.prompt = prompt
+        self.memories = list(memories)
+        self.input_key = input_key
+        self.output_key = output_key
+
+    def _config(self, callbacks: Any) -> Dict:
+        return {"callbacks": callbacks} if callbacks else {}
+
+    def predict(self, callbacks: Any = None, **inputs: Any) -> str:
+        variables = dict(inputs)
+        for memory in self.memories:
+            variables.update(memory.load_memory_variables(inputs))
+        response = self.llm.invoke(self.prompt.format(**variables), config=self._config(callbacks))
+        for memory in self.memories:
+            memory.save_context(inputs, {self.output_key: response})
+        return response
+
+    async def apredict(self, callbacks: Any = None, **inputs: Any) -> str:
+        variables = dict(inputs)
+        for memory in self.memories:
+            variables.update(await memory.aload_memory_variables(inputs))
+        response = await self.llm.ainvoke(self.prompt.format(**variables), config=self._config(callbacks))
+        for memory in self.memories:
+            await memory.asave_context(inputs, {self.output_key: response})
+        return response
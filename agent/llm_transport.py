@@ -0,0 +1,358 @@
+import asyncio
+import contextvars
+import random
+import socket
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import httpcore
+import httpx
+
+from metrics import registry
+
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError)
+
+
+class CircuitOpen(httpx.TransportError):
+    """Raised without contacting the provider while the circuit breaker is open."""
+
+
+class RetryBudget:
+    """Token bucket that keeps retries to a fraction of all requests, process-wide.
+
+    Every request deposits `ratio` tokens and every retry spends one, so retries
+    cannot multiply the load on a provider that is already failing. A trickle of
+    `min_per_second` tokens keeps retries possible at low traffic.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        amount += (now - self._updated) * self.min_per_second
+        self._updated = now
+        self._tokens = min(self.max_tokens, self._tokens + amount)
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(0.0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failed requests and fails fast for `cooldown` seconds.
+
+    After the cooldown a single probe request is let through (half-open); its
+    outcome closes the circuit again or restarts the cooldown.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self._opened = registry.counter("llm_circuit_opened_total")
+        self._rejected = registry.counter("llm_circuit_rejected_total")
+
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return "open"
+
+    def before_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if not self._probing and time.monotonic() - self._opened_at >= self.cooldown:
+                self._probing = True
+                return
+        self._rejected.inc()
+        raise CircuitOpen("LLM provider circuit breaker is open")
+
+    def abandon(self):
+        """A request ended without an outcome (cancelled); let the next one probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, success: bool):
+        with self._lock:
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                self._probing = False
+                return
+            self._failures += 1
+            if self._probing or self._failures >= self.threshold:
+                if self._opened_at is None or self._probing:
+                    self._opened.inc()
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class RetryPolicy:
+    """Jittered exponential backoff shared by the sync and async transports."""
+
+    def __init__(
+        self,
+        budget: RetryBudget,
+        breaker: CircuitBreaker,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+    ):
+        self.budget = budget
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._retries = registry.counter("llm_http_retries_total")
+        self._denied = registry.counter("llm_http_retries_over_budget_total")
+
+    def should_retry(self, attempt: int, response: Optional[httpx.Response], error: Optional[Exception]) -> bool:
+        if error is None and response.status_code not in RETRY_STATUSES:
+            return False
+        if error is not None and not isinstance(error, RETRY_ERRORS):
+            return False
+        if attempt >= self.max_retries:
+            return False
+        if not self.budget.withdraw():
+            self._denied.inc()
+            return False
+        self._retries.inc()
+        return True
+
+    def delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        """Full-jitter backoff, or the provider's Retry-After if it asks for longer."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if response is not None:
+            try:
+                delay = max(delay, min(self.max_delay, float(response.headers.get("retry-after", 0))))
+            except ValueError:
+                pass
+        return delay
+
+    def outcome(self, response: Optional[httpx.Response], error: Optional[Exception]):
+        # 4xx other than throttling are the caller's fault, not the provider's.
+        failed = error is not None or response.status_code >= 500 or response.status_code == 429
+        self.breaker.record(not failed)
+
+    def stats(self) -> Dict:
+        return {"circuit": self.breaker.state(), "max_retries": self.max_retries}
+
+
+_abort_scope: "contextvars.ContextVar[Optional[AbortScope]]" = contextvars.ContextVar("llm_abort_scope", default=None)
+
+
+class AbortScope:
+    """Lets another thread abort the requests made inside `with scope:`.
+
+    A sync request blocked on a silent upstream cannot be interrupted by
+    closing its response from another thread, so the scope keeps track of the
+    sockets its thread is reading from and `abort` shuts them down, which ends
+    the read at once. An aborted request is not retried.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._streams: Set[httpcore.NetworkStream] = set()
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self) -> "AbortScope":
+        self._token = _abort_scope.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _abort_scope.reset(self._token)
+
+    def _attach(self, stream: httpcore.NetworkStream):
+        with self._lock:
+            if self.aborted:
+                raise httpcore.ReadError("Request aborted.")
+            self._streams.add(stream)
+
+    def _detach(self, stream: httpcore.NetworkStream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            # Under the lock, so a stream is only shut down while this scope still reads it.
+            for stream in self._streams:
+                sock = stream.get_extra_info("socket")
+                if sock is not None:
+                    try:
+                        sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+
+class _AbortableStream(httpcore.NetworkStream):
+    def __init__(self, stream: httpcore.NetworkStream):
+        self._stream = stream
+
+    def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        scope = _abort_scope.get()
+        if scope is None:
+            return self._stream.read(max_bytes, timeout)
+        scope._attach(self._stream)
+        try:
+            return self._stream.read(max_bytes, timeout)
+        finally:
+            scope._detach(self._stream)
+
+    def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        scope = _abort_scope.get()
+        if scope is not None and scope.aborted:
+            raise httpcore.WriteError("Request aborted.")
+        self._stream.write(buffer, timeout)
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname=None, timeout=None) -> httpcore.NetworkStream:
+        return _AbortableStream(self._stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info: str):
+        return self._stream.get_extra_info(info)
+
+
+class _AbortableBackend(httpcore.NetworkBackend):
+    """Network backend whose streams can be shut down through an AbortScope."""
+
+    def __init__(self, backend: httpcore.NetworkBackend):
+        self._backend = backend
+
+    def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        return _AbortableStream(self._backend.connect_tcp(host, port, timeout, local_address, socket_options))
+
+    def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return _AbortableStream(self._backend.connect_unix_socket(path, timeout, socket_options))
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+class RetryingTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, policy: RetryPolicy):
+        self.transport = transport
+        self.policy = policy
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.breaker.before_request()
+        self.policy.budget.deposit()
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                response = self.transport.handle_request(request)
+            except Exception as e:
+                scope = _abort_scope.get()
+                if scope is not None and scope.aborted:
+                    # Given up on by the caller; says nothing about the provider.
+                    self.policy.breaker.abandon()
+                    raise
+                error = e
+            if not self.policy.should_retry(attempt, response, error):
+                self.policy.outcome(response, error)
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                response.close()
+            time.sleep(self.policy.delay(attempt, response))
+            attempt += 1
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRetryingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, policy: RetryPolicy):
+        self.transport = transport
+        self.policy = policy
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.breaker.before_request()
+        self.policy.budget.deposit()
+        attempt = 0
+        while True:
+            response, error = None, None
+            try:
+                response = await self.transport.handle_async_request(request)
+            except asyncio.CancelledError:
+                self.policy.breaker.abandon()
+                raise
+            except Exception as e:
+                error = e
+            if not self.policy.should_retry(attempt, response, error):
+                self.policy.outcome(response, error)
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                await response.aclose()
+            await asyncio.sleep(self.policy.delay(attempt, response))
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def request_timeout(connect_timeout: float = 5.0, read_timeout: float = 60.0) -> httpx.Timeout:
+    """Timeout for LLM calls.
+
+    The OpenAI SDK sends its own timeout with every request, overriding the
+    client's, so this has to be given to the langchain models as well.
+    """
+    return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+
+def build_http_clients(
+    policy: RetryPolicy,
+    max_connections: int = 100,
+    max_keepalive: int = 20,
+    keepalive_expiry: float = 30.0,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 60.0,
+) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Pooled keep-alive sync and async clients that retry through `policy`."""
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=keepalive_expiry,
+    )
+    timeout = request_timeout(connect_timeout, read_timeout)
+    transport = httpx.HTTPTransport(limits=limits)
+    # httpx takes no network backend, so it is swapped into the pool it created.
+    transport._pool._network_backend = _AbortableBackend(transport._pool._network_backend)
+    client = httpx.Client(
+        transport=RetryingTransport(transport, policy),
+        timeout=timeout,
+    )
+    async_client = httpx.AsyncClient(
+        transport=AsyncRetryingTransport(httpx.AsyncHTTPTransport(limits=limits), policy),
+        timeout=timeout,
+    )
+    return client, async_client
@@ -1,52 +1,198 @@
-from fastapi import FastAPI, HTTPException
+import os
+import time
+
+# Imported first, so that with AGENT_STARTUP_PROFILE=1 the import profiler sees
+# everything below. Heavy modules (langchain, the OpenAI client, PyPDF2) are
+# only imported by the warmup steps further down.
+from startup import ImportProfiler, NotReady, Warmup
+
+IMPORT_STARTED = time.perf_counter()
+import_profiler = ImportProfiler()
+if os.getenv("AGENT_STARTUP_PROFILE", "0") == "1":
+    import_profiler.install()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import uvicorn
 from dotenv import load_dotenv
-from typing import Optional, Dict
-import PyPDF2
-import os
+from typing import Optional, List, Set, Tuple
 import json
+import asyncio
+import hashlib
+import uuid
 
-# Use ephemeral memory (in‑process)
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain.prompts import PromptTemplate
-from langchain_openai import OpenAI
+from admission import AdmissionController, Overloaded
+from cancellation import (
+    CancellationHandler,
+    ClientDisconnected,
+    cancel_on_disconnect,
+    cancelled_calls,
+    disconnects,
+)
+from llm_transport import CircuitBreaker, RetryBudget, RetryPolicy, build_http_clients, request_timeout
+from metrics import registry
+from profiles import ProfileRegistry, RenderedProfile
+from response_cache import ResponseCache
+from safety import load_matcher
+from semantic_cache import SemanticResponseCache
+from singleflight import SingleFlight
+from sessions import Session, SessionStore
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the language model
-llm = OpenAI()
+# Longest a request waits for the startup warmup before it is answered with 503.
+WARMUP_TIMEOUT = float(os.getenv("AGENT_WARMUP_TIMEOUT", "60"))
 
-# Create ephemeral memory – this will only persist while the server is running.
-memory = ConversationBufferMemory(return_messages=True)
+# Session limits – each user/session gets its own ephemeral memory, bounded by these caps.
+MAX_SESSIONS = int(os.getenv("AGENT_MAX_SESSIONS", "1000"))
+MAX_SESSION_BYTES = int(os.getenv("AGENT_MAX_SESSION_BYTES", str(64 * 1024 * 1024)))
+SESSION_IDLE_SECONDS = float(os.getenv("AGENT_SESSION_IDLE_SECONDS", "3600"))
 
-# Global variable to store the last inserted profile.
-current_profile: Optional[Dict] = None
+# "buffer" keeps the whole history verbatim; "summary" keeps the last
+# AGENT_HISTORY_TURNS turns and folds older ones into a rolling summary.
+MEMORY_MODE = os.getenv("AGENT_MEMORY_MODE", "buffer")
+HISTORY_TURNS = int(os.getenv("AGENT_HISTORY_TURNS", "6"))
+HISTORY_TOKEN_LIMIT = int(os.getenv("AGENT_HISTORY_TOKEN_LIMIT", "1500"))
 
+# Where conversation histories live. Unset, they stay in this process. "postgres"
+# keeps them as append-only logs in the DB_* database, so several workers or
+# replicas can serve the same session; "log" keeps them in log files under
+# AGENT_HISTORY_DIR, surviving restarts of a single worker; "memory" is the same
+# log, in process.
+HISTORY_BACKEND = os.getenv("AGENT_HISTORY_BACKEND", "")
+HISTORY_DIR = os.getenv("AGENT_HISTORY_DIR", ".history")
+HISTORY_SHARDS = int(os.getenv("AGENT_HISTORY_SHARDS", "16"))
+HISTORY_FSYNC = os.getenv("AGENT_HISTORY_FSYNC", "1") == "1"
+HISTORY_COMPACT_BYTES = int(float(os.getenv("AGENT_HISTORY_COMPACT_MB", "64")) * 1024 * 1024)
+HISTORY_TABLE = os.getenv("AGENT_HISTORY_TABLE", "agent_chat_history")
+HISTORY_DB_CONNECTIONS = int(os.getenv("AGENT_HISTORY_DB_CONNECTIONS", "10"))
+# Concurrent history reads within this window are sent as one query.
+HISTORY_READ_WINDOW = float(os.getenv("AGENT_HISTORY_READ_WINDOW_MS", "2")) / 1000
+# How long startup keeps retrying while the history database is not reachable yet.
+HISTORY_CONNECT_TIMEOUT = float(os.getenv("AGENT_HISTORY_CONNECT_TIMEOUT", "120"))
+DB_HOST = os.getenv("DB_HOST", "postgres")
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
+DB_NAME = os.getenv("DB_NAME", "authdb")
+DB_USER = os.getenv("DB_USER", "authuser")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "authpassword")
 
-# Function to load Crestor medication information from a PDF file.
-def load_crestor_info(pdf_path: str) -> str:
+# Rendered profiles kept in memory, by fingerprint; clients that sent a profile
+# once may send only its fingerprint while it is cached.
+PROFILE_CACHE_SIZE = int(os.getenv("AGENT_PROFILE_CACHE_SIZE", "1000"))
+
+# "chain" runs each turn through langchain's ConversationChain; "lean" formats the
+# prompt, calls the model and saves the turn directly, with the same result.
+EXECUTION_MODE = os.getenv("AGENT_EXECUTION", "chain")
+
+# Token budget of the whole rendered prompt; history, label excerpts and profile
+# are trimmed (in that order) to fit. 0 disables trimming.
+PROMPT_TOKEN_BUDGET = int(os.getenv("AGENT_PROMPT_TOKEN_BUDGET", "3500"))
+
+# Opt-in cache of answers to stateless first-turn questions.
+RESPONSE_CACHE_ENABLED = os.getenv("AGENT_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("AGENT_RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("AGENT_RESPONSE_CACHE_TTL", "3600"))
+# Opt-in semantic layer: paraphrases of a cached question are served when their
+# embedding similarity reaches the threshold.
+SEMANTIC_CACHE_ENABLED = os.getenv("AGENT_SEMANTIC_CACHE", "0") == "1"
+SEMANTIC_CACHE_COLLECTION = os.getenv("AGENT_SEMANTIC_CACHE_COLLECTION", "response_cache")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("AGENT_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = float(os.getenv("AGENT_SEMANTIC_CACHE_TTL", "86400"))
+
+# Identical first-turn questions in flight at the same time share one model call.
+COALESCE_ENABLED = os.getenv("AGENT_COALESCE", "1") == "1"
+
+# Admission control for outbound LLM calls: concurrent calls, queued calls and
+# the longest a call may wait in the queue before it is shed with 429.
+LLM_MAX_CONCURRENCY = int(os.getenv("AGENT_LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUE = int(os.getenv("AGENT_LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("AGENT_LLM_QUEUE_TIMEOUT", "10"))
+
+# /chat/batch: items per request, items answered at once by default and at most,
+# and how often an item shed by admission control is retried.
+BATCH_MAX_ITEMS = int(os.getenv("AGENT_BATCH_MAX_ITEMS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("AGENT_BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("AGENT_BATCH_MAX_CONCURRENCY", "32"))
+BATCH_OVERLOAD_RETRIES = int(os.getenv("AGENT_BATCH_OVERLOAD_RETRIES", "3"))
+
+# HTTP transport to the LLM provider: connection pool, timeouts (seconds), retries
+# with jittered backoff limited to AGENT_LLM_RETRY_BUDGET of requests, and a circuit
+# breaker that fails fast for AGENT_LLM_BREAKER_COOLDOWN seconds after
+# AGENT_LLM_BREAKER_THRESHOLD consecutive failures.
+LLM_MAX_CONNECTIONS = int(os.getenv("AGENT_LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("AGENT_LLM_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("AGENT_LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("AGENT_LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("AGENT_LLM_READ_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("AGENT_LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BUDGET = float(os.getenv("AGENT_LLM_RETRY_BUDGET", "0.2"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("AGENT_LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("AGENT_LLM_BREAKER_COOLDOWN", "30"))
+
+# Opt-in hedging: a completion with no token after the AGENT_HEDGE_PERCENTILE
+# time-to-first-token is sent again, for at most AGENT_HEDGE_BUDGET of calls.
+HEDGE_ENABLED = os.getenv("AGENT_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("AGENT_HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET = float(os.getenv("AGENT_HEDGE_BUDGET", "0.1"))
+HEDGE_MIN_DELAY = float(os.getenv("AGENT_HEDGE_MIN_DELAY", "0.25"))
+HEDGE_MAX_DELAY = float(os.getenv("AGENT_HEDGE_MAX_DELAY", "5"))
+
+# Retrieval of drug-label chunks from Milvus.
+RETRIEVAL_ENABLED = os.getenv("AGENT_RETRIEVAL", "1") == "1"
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+LABEL_COLLECTION = os.getenv("AGENT_LABEL_COLLECTION", "crestor_label")
+EMBEDDING_MODEL = os.getenv("AGENT_EMBEDDING_MODEL", "text-embedding-3-small")
+RETRIEVAL_TOP_K = int(os.getenv("AGENT_RETRIEVAL_TOP_K", "4"))
+# Hybrid retrieval also searches a BM25 index of the same chunks and merges the
+# top AGENT_RETRIEVAL_CANDIDATES of both by reciprocal rank fusion.
+RETRIEVAL_HYBRID = os.getenv("AGENT_RETRIEVAL_HYBRID", "1") == "1"
+RETRIEVAL_CANDIDATES = int(os.getenv("AGENT_RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_RRF_K = int(os.getenv("AGENT_RETRIEVAL_RRF_K", "60"))
+# Record of what was ingested into the label collection, so unchanged labels are
+# not re-embedded on startup; defaults to a file in the PDF text cache.
+INGEST_MANIFEST = os.getenv("AGENT_INGEST_MANIFEST")
+# Embeddings are kept on disk by content hash, so a chunk or question is only
+# sent to the provider once; concurrent misses within the window share a call.
+EMBEDDING_CACHE_ENABLED = os.getenv("AGENT_EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_DIR = os.getenv("AGENT_EMBEDDING_CACHE_DIR", ".embedding_cache")
+EMBEDDING_CACHE_DTYPE = os.getenv("AGENT_EMBEDDING_CACHE_DTYPE", "float16")
+EMBEDDING_BATCH_WINDOW = float(os.getenv("AGENT_EMBEDDING_BATCH_WINDOW_MS", "10")) / 1000
+EMBEDDING_BATCH_SIZE = int(os.getenv("AGENT_EMBEDDING_BATCH_SIZE", "256"))
+
+retry_policy = RetryPolicy(
+    RetryBudget(ratio=LLM_RETRY_BUDGET),
+    CircuitBreaker(threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN),
+    max_retries=LLM_MAX_RETRIES,
+)
+http_client, http_async_client = build_http_clients(
+    retry_policy,
+    max_connections=LLM_MAX_CONNECTIONS,
+    max_keepalive=LLM_MAX_KEEPALIVE,
+    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    connect_timeout=LLM_CONNECT_TIMEOUT,
+    read_timeout=LLM_READ_TIMEOUT,
+)
+llm_timeout = request_timeout(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT)
+
+# Function to load the text of each page of a PDF file (parsed once, then cached on disk).
+def load_pdf_pages(pdf_path: str) -> List[str]:
     try:
-        with open(pdf_path, "rb") as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-            return text
+        import pdf_cache
+
+        return pdf_cache.load_pages(pdf_path)
     except Exception as e:
         print(f"Error reading PDF: {e}")
-        return ""
+        return []
+
 
+# Function to load Crestor medication information from a PDF file.
+def load_crestor_info(pdf_path: str) -> str:
+    return "".join(page + "\n" for page in load_pdf_pages(pdf_path) if page)
 
-# Load the Crestor info from the PDF (adjust the path as needed)
-crestor_info = load_crestor_info("crestor_eng.pdf")
-# Limit the length to the first 5000 characters
-crestor_info = crestor_info[:5000]
 
 # Define the prompt template.
 prompt_template = """
@@ -55,30 +201,300 @@ My responses do not substitute for professional medical advice, diagnosis, or tr
 If you are experiencing an emergency or severe symptoms, please seek immediate help.
 
 Relevant conversation so far: {history}
+Relevant medication label excerpts: {context}
 User: {input}
 Chatbot:
 """
-prompt = PromptTemplate(input_variables=["history", "input"], template=prompt_template)
+# Part of every response cache key, so editing the template invalidates cached answers.
+PROMPT_VERSION = hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:12]
+
+# -------------------------------
+# Warmup
+# -------------------------------
+# Everything below is loaded by `warmup`, on a background thread once the server
+# starts, so importing this module stays fast. Requests wait for it to finish.
+llm = None
+hedger = None
+embeddings = None
+crestor_pages: List[str] = []
+crestor_info = ""
+label_retriever = None
+semantic_cache = None
+tokenizer = None
+prompt = None
+history_backend = None
+history_reader = None
+
+warmup = Warmup()
+
+
+@warmup.step("llm")
+def load_llm():
+    global llm, hedger, embeddings
+    from langchain_openai import OpenAI, OpenAIEmbeddings
+
+    # Streamed internally so a call can be aborted between tokens. Retries happen
+    # in the transport, under the shared budget, instead of in the OpenAI client.
+    llm = OpenAI(
+        streaming=True,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        timeout=llm_timeout,
+        max_retries=0,
+    )
+    if HEDGE_ENABLED:
+        from hedging import HedgedLLM, Hedger
+
+        hedger = Hedger(
+            percentile=HEDGE_PERCENTILE,
+            min_delay=HEDGE_MIN_DELAY,
+            max_delay=HEDGE_MAX_DELAY,
+            budget=HEDGE_BUDGET,
+        )
+        llm = HedgedLLM(llm=llm, hedger=hedger)
+    embeddings = OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        http_client=http_client,
+        http_async_client=http_async_client,
+        timeout=llm_timeout,
+        max_retries=0,
+    )
+    if EMBEDDING_CACHE_ENABLED:
+        from embedding_cache import CachedEmbeddings
+
+        embeddings = CachedEmbeddings.in_directory(
+            embeddings,
+            EMBEDDING_MODEL,
+            EMBEDDING_CACHE_DIR,
+            dtype=EMBEDDING_CACHE_DTYPE,
+            window=EMBEDDING_BATCH_WINDOW,
+            max_batch=EMBEDDING_BATCH_SIZE,
+        )
+
+
+@warmup.step("label")
+def load_label():
+    global crestor_pages, crestor_info
+    # Load the Crestor info from the PDF (adjust the path as needed)
+    crestor_pages = load_pdf_pages("crestor_eng.pdf")
+    # Without retrieval, fall back to the first 5000 characters of the label.
+    crestor_info = "".join(page + "\n" for page in crestor_pages if page)[:5000]
+
+
+@warmup.step("prompt")
+def load_prompt():
+    global tokenizer, prompt
+    from prompt_budget import BudgetedPromptTemplate, PromptBudgeter, Tokenizer
+
+    tokenizer = Tokenizer(llm.model_name)
+    prompt = BudgetedPromptTemplate(
+        input_variables=["history", "context", "input"],
+        template=prompt_template,
+        budgeter=PromptBudgeter(tokenizer, PROMPT_TOKEN_BUDGET) if PROMPT_TOKEN_BUDGET else None,
+    )
+
+
+@warmup.step("retrieval")
+def load_retrieval():
+    global label_retriever, semantic_cache
+    from pdf_cache import CACHE_DIR
+    from retrieval import LabelRetriever
+
+    if RETRIEVAL_ENABLED:
+        label_retriever = LabelRetriever(
+            MILVUS_URI,
+            LABEL_COLLECTION,
+            embeddings,
+            source="crestor_eng.pdf",
+            pages_loader=lambda: crestor_pages,
+            k=RETRIEVAL_TOP_K,
+            hybrid=RETRIEVAL_HYBRID,
+            candidates=RETRIEVAL_CANDIDATES,
+            rrf_k=RETRIEVAL_RRF_K,
+            manifest_path=INGEST_MANIFEST or os.path.join(CACHE_DIR, f"ingest-{LABEL_COLLECTION}.json"),
+        )
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache = SemanticResponseCache(
+            MILVUS_URI,
+            SEMANTIC_CACHE_COLLECTION,
+            embeddings,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            ttl=SEMANTIC_CACHE_TTL,
+        )
+
+
+@warmup.step("sessions")
+def load_session_modules():
+    # What create_session needs, so the first session does not pay for the imports.
+    # The lean path never imports langchain's chains (langchain.memory imports them too).
+    import lean  # noqa: F401
+
+    if EXECUTION_MODE != "lean":
+        import langchain.chains  # noqa: F401
+        import langchain.memory  # noqa: F401
+    if MEMORY_MODE == "summary":
+        import summary_memory  # noqa: F401
+
+
+def connect_postgres_history():
+    """Connect to the history database, retrying with backoff while it starts up.
+
+    The database container may still be starting when the agent is, so a
+    refused connection is retried for up to AGENT_HISTORY_CONNECT_TIMEOUT seconds.
+    """
+    from psycopg2 import OperationalError
+    from history import PostgresHistory
+
+    deadline = time.monotonic() + HISTORY_CONNECT_TIMEOUT
+    delay = 0.5
+    while True:
+        try:
+            return PostgresHistory(
+                {"host": DB_HOST, "port": DB_PORT, "dbname": DB_NAME, "user": DB_USER, "password": DB_PASSWORD},
+                table=HISTORY_TABLE,
+                max_connections=HISTORY_DB_CONNECTIONS,
+            )
+        except OperationalError as e:
+            if time.monotonic() + delay > deadline:
+                raise
+            print(f"History database not reachable, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 10.0)
 
-# Create the global conversation chain using ephemeral memory.
-conversation_with_memory = ConversationChain(
-    llm=llm, prompt=prompt, memory=memory, verbose=True
+
+@warmup.step("history")
+def load_history():
+    global history_backend, history_reader
+    if not HISTORY_BACKEND:
+        return
+    from history import BatchedReader, InMemoryHistory
+
+    if HISTORY_BACKEND == "postgres":
+        history_backend = connect_postgres_history()
+    elif HISTORY_BACKEND == "log":
+        from history_log import LogHistory
+
+        history_backend = LogHistory(
+            HISTORY_DIR,
+            shards=HISTORY_SHARDS,
+            fsync=HISTORY_FSYNC,
+            compact_bytes=HISTORY_COMPACT_BYTES,
+        )
+    elif HISTORY_BACKEND == "memory":
+        history_backend = InMemoryHistory()
+    else:
+        raise ValueError(f"Unknown AGENT_HISTORY_BACKEND {HISTORY_BACKEND!r}")
+    history_reader = BatchedReader(history_backend, window=HISTORY_READ_WINDOW)
+
+
+@warmup.step("milvus", required=False)
+def connect_milvus():
+    # Connects, and ingests the label into an empty collection, before the first question.
+    if label_retriever is not None:
+        label_retriever.connect()
+
+# Canned replies used instead of (or in place of) the model output.
+EMERGENCY_RESPONSE = "It sounds like you may be experiencing an emergency. Please seek immediate medical assistance or call your local emergency services."
+SENSITIVE_RESPONSE = "I'm sorry you're experiencing these feelings. Please consider reaching out to a trusted healthcare provider or crisis intervention service immediately."
+UNCERTAIN_RESPONSE = "I'm not completely sure about that. It would be best to consult a healthcare professional for personalized advice."
+ERROR_RESPONSE = "An error occurred processing your request."
+BUSY_RESPONSE = "The assistant is handling too many requests right now. Please try again in a moment."
+
+
+def create_session(session_id: str, persistent: bool = True) -> Session:
+    """Create a conversation chain with its own memory.
+
+    With a history backend the memory's history is the session's shared log,
+    loaded on the first turn; otherwise, or if `persistent` is false, it is
+    ephemeral and only lives while the server is running.
+    """
+    from lean import BufferMemory, LeanConversation
+    from retrieval import LabelContextMemory
+
+    history = None
+    memory_args = {"return_messages": True, "input_key": "input"}
+    if history_backend is not None and persistent:
+        from history import StoredChatHistory
+
+        history = StoredChatHistory(session_id, history_backend, history_reader)
+        memory_args["chat_memory"] = history
+    if MEMORY_MODE == "summary":
+        from summary_memory import RollingSummaryMemory
+
+        memory = RollingSummaryMemory(
+            llm=llm,
+            tokenizer=tokenizer,
+            admission=admission,
+            max_turns=HISTORY_TURNS,
+            max_token_limit=HISTORY_TOKEN_LIMIT,
+            **memory_args,
+        )
+    elif EXECUTION_MODE == "lean":
+        memory = BufferMemory(**memory_args)
+    else:
+        from langchain.memory import ConversationBufferMemory
+
+        memory = ConversationBufferMemory(**memory_args)
+    # Label excerpts are looked up per turn and exposed to the prompt as {context}.
+    context_memory = LabelContextMemory(retriever=label_retriever)
+    if EXECUTION_MODE == "lean":
+        conversation = LeanConversation(llm, prompt, [memory, context_memory])
+        return Session(session_id, memory, conversation, context_memory, history)
+    from langchain.chains import ConversationChain
+    from langchain.memory import CombinedMemory
+
+    conversation_with_memory = ConversationChain(
+        llm=llm,
+        prompt=prompt,
+        memory=CombinedMemory(memories=[memory, context_memory]),
+        verbose=True,
+    )
+    return Session(session_id, memory, conversation_with_memory, context_memory, history)
+
+
+response_cache: Optional[ResponseCache] = None
+if RESPONSE_CACHE_ENABLED:
+    response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+inflight = SingleFlight("llm", cancelled=(ClientDisconnected,))
+admission = AdmissionController(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+
+session_store = SessionStore(
+    create_session,
+    max_sessions=MAX_SESSIONS,
+    max_bytes=MAX_SESSION_BYTES,
+    idle_ttl=SESSION_IDLE_SECONDS,
 )
 
 
 # -------------------------------
 # Helper Functions
 # -------------------------------
-def insert_profile_into_memory(profile: dict):
-    """Clear previous conversation memory if the profile has changed, then insert the new profile data."""
-    global current_profile
-    if current_profile == profile:
-        print("Profile unchanged. Not updating memory.")
-        return
+def resolve_session_id(chat_request: "ChatRequest") -> Optional[str]:
+    """Pick the key of the session a request belongs to; None if the request is anonymous."""
+    if chat_request.session_id:
+        return chat_request.session_id
+    profile = chat_request.profile or {}
+    for key in ("user_id", "id", "username"):
+        if profile.get(key) is not None:
+            return f"user:{profile[key]}"
+    return None
 
-    current_profile = profile
-    memory.clear()
 
+def request_session(chat_request: "ChatRequest") -> Session:
+    """The session of a request; an anonymous request gets a fresh one that is not kept.
+
+    Anonymous requests must never share a conversation, or one user's history
+    would end up in another user's prompt.
+    """
+    session_id = resolve_session_id(chat_request)
+    if session_id is None:
+        return create_session(f"anonymous:{uuid.uuid4().hex}", persistent=False)
+    return session_store.get(session_id)
+
+
+def render_profile(profile: dict) -> Tuple[str, bool]:
+    """Render the profile as the text inserted into memory; also tell whether the patient takes Crestor."""
     name = profile.get("first_name", "Unknown")
     age = profile.get("age", "unknown")
     diagnosis = profile.get("diagnosis", "no diagnosis")
@@ -90,53 +506,285 @@ def insert_profile_into_memory(profile: dict):
         f"My name is {name}. I am {age} years old. I have been diagnosed with {diagnosis}. "
         f"I currently take {medicine}. My recommended activities are {activities_str}."
     )
-    # If the user's medicine includes "crestor", append additional info from the PDF with citation.
-    if "crestor" in medicine.lower() and crestor_info:
+    # If the user's medicine includes "crestor", retrieve matching label excerpts on every turn,
+    # or, without retrieval, append additional info from the PDF with citation.
+    takes_crestor = "crestor" in medicine.lower()
+    if takes_crestor and label_retriever is None and crestor_info:
         profile_text += f"\nAdditional medication info: {crestor_info}\n[Source: CRESTOR Full Prescribing Information (crestor_eng.pdf)]"
+    return profile_text, takes_crestor
+
+
+profile_registry = ProfileRegistry(render_profile, max_entries=PROFILE_CACHE_SIZE)
+
+
+def hydrate_profile(chat_request: "ChatRequest") -> Optional[RenderedProfile]:
+    """Resolve the request's profile, sent in full or by fingerprint, to its cached rendering.
+
+    Fills in both `profile` and `profile_fingerprint` of the request. A fingerprint
+    the server does not know (any more) is answered with 409, so the client resends
+    the full profile.
+    """
+    if chat_request.profile:
+        entry = profile_registry.register(chat_request.profile)
+    elif chat_request.profile_fingerprint:
+        entry = profile_registry.get(chat_request.profile_fingerprint)
+        if entry is None:
+            raise HTTPException(status_code=409, detail="Unknown profile fingerprint; send the full profile.")
+    else:
+        return None
+    chat_request.profile = entry.profile
+    chat_request.profile_fingerprint = entry.fingerprint
+    return entry
+
+
+def insert_profile_into_memory(session: Session, profile: RenderedProfile):
+    """Clear the session's memory if the profile has changed, then insert the new profile data."""
+    if session.profile is not None and session.profile.fingerprint == profile.fingerprint:
+        print("Profile unchanged. Not updating memory.")
+        return
+
+    session.profile = profile
+    memory = session.memory
+    memory.clear()
+    # Patients on Crestor get matching label excerpts retrieved on every turn.
+    session.context_memory.enabled = profile.takes_crestor and label_retriever is not None
+    if session.history is not None:
+        # Lets other workers restore session.profile from the shared history.
+        session.history.set_profile(profile.profile)
 
     # Insert the profile data into memory as a single context entry.
-    memory.save_context({"input": "Profile"}, {"output": profile_text})
-    print("Updated memory with profile:", profile_text)
+    memory.save_context({"input": "Profile"}, {"output": profile.text})
+    print("Updated memory with profile:", profile.text)
+
+
+def sync_session(session: Session):
+    """Catch up with turns that other workers saved to the session's shared history."""
+    history = session.history
+    if history is None:
+        return
+    history.refresh()
+    if hasattr(session.memory, "summary"):
+        session.memory.summary = history.summary
+    if history.profile is None:
+        session.profile = None
+    elif session.profile is None or session.profile.profile != history.profile:
+        profile = profile_registry.register(history.profile)
+        session.profile = profile
+        session.context_memory.enabled = profile.takes_crestor and label_retriever is not None
+
+
+def prepare_session(session: Session, profile: Optional[RenderedProfile]):
+    """Bring the session up to date and apply the request's profile; the caller holds its lock."""
+    sync_session(session)
+    if profile is not None:
+        print("Profile provided. Updating memory with new profile data.")
+        insert_profile_into_memory(session, profile)
+    else:
+        print("No profile provided with this request.")
+
+
+# Emergency, sensitive and uncertainty keywords are loaded from safety_keywords.json
+# and compiled into one matcher, so each text is scanned once for all categories.
+safety_matcher = load_matcher()
+# While streaming, only the newest chunk plus this many trailing characters can
+# complete an uncertainty indicator, so there is no need to rescan the whole text.
+UNCERTAINTY_WINDOW = safety_matcher.max_term_length + 1
+
+
+def history_token_count(memory) -> int:
+    """Number of tokens the session's history contributes to the next prompt."""
+    from langchain_core.messages import get_buffer_string
+
+    messages = memory.load_memory_variables({})[memory.memory_key]
+    return tokenizer.count(get_buffer_string(messages))
+
+
+def is_first_turn(session: Session) -> bool:
+    """True while the session holds nothing but (at most) its profile."""
+    from langchain_core.messages import HumanMessage
+
+    if getattr(session.memory, "summary", ""):
+        return False
+    return not any(
+        isinstance(message, HumanMessage) and message.content != "Profile"
+        for message in session.memory.chat_memory.messages
+    )
+
+
+def shared_turn_key(session: Session, user_input: str) -> Optional[Tuple]:
+    """Key under which this turn's answer may be shared with other sessions, or None.
+
+    Only stateless first turns qualify. Only clinical attributes go into the
+    fingerprint, so patients with the same medication and diagnosis share answers.
+    """
+    if not is_first_turn(session):
+        return None
+    fingerprint = session.profile.clinical_fingerprint if session.profile else "none"
+    return ResponseCache.key(user_input, fingerprint, PROMPT_VERSION)
+
+
+def is_shareable_response(session: Session, response: str) -> bool:
+    # Never share an answer that addresses the patient by name.
+    name = str(session.profile.profile.get("first_name") or "").casefold() if session.profile else ""
+    return not (name and name in response.casefold())
+
+
+def lookup_cached_response(cache_key: Tuple) -> Optional[str]:
+    """Exact match first, then a semantically similar question with the same profile fingerprint."""
+    if response_cache is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    if semantic_cache is not None:
+        cached = semantic_cache.get(*cache_key)
+        if cached is not None:
+            if response_cache is not None:
+                response_cache.put(cache_key, cached)
+            return cached
+    return None
+
+
+def store_cached_response(cache_key: Tuple, session: Session, response: str):
+    if not is_shareable_response(session, response):
+        return
+    if response_cache is not None:
+        response_cache.put(cache_key, response)
+    if semantic_cache is not None:
+        semantic_cache.put(*cache_key, response)
+
+
+def run_chain(
+    session: Session, user_input: str, cancel: Optional[CancellationHandler] = None
+) -> str:
+    """Call the model through the session's chain once an LLM slot is free."""
+    with admission.slot():
+        return session.conversation.predict(
+            input=user_input, callbacks=[cancel] if cancel is not None else None
+        )
+
+
+async def arun_chain(session: Session, user_input: str) -> str:
+    async with admission.aslot():
+        try:
+            return await session.conversation.apredict(input=user_input)
+        except asyncio.CancelledError:
+            cancelled_calls.inc()
+            raise
+
+
+def predict_turn(
+    session: Session, user_input: str, cancel: Optional[CancellationHandler] = None
+) -> str:
+    """Run one turn through the session's chain.
+
+    Shareable turns are served from the response caches when possible, and
+    identical ones already in flight for another session are waited on instead
+    of calling the model again. `cancel` aborts the model call once its event is set.
+    """
+    share_key = shared_turn_key(session, user_input)
+    if share_key is None:
+        return run_chain(session, user_input, cancel)
+
+    caching = response_cache is not None or semantic_cache is not None
+    if caching:
+        cached = lookup_cached_response(share_key)
+        if cached is not None:
+            session.memory.save_context({"input": user_input}, {"response": cached})
+            return cached
+
+    def leader():
+        response = run_chain(session, user_input, cancel)
+        return response, is_shareable_response(session, response)
+
+    if COALESCE_ENABLED:
+        (generated_response, shareable), shared = inflight.do(share_key, leader)
+    else:
+        (generated_response, shareable), shared = leader(), False
+    if shared:
+        if shareable:
+            session.memory.save_context({"input": user_input}, {"response": generated_response})
+        else:
+            generated_response = run_chain(session, user_input, cancel)
+    if caching:
+        store_cached_response(share_key, session, generated_response)
+    return generated_response
+
+
+async def apredict_turn(session: Session, user_input: str) -> str:
+    """Async variant of predict_turn."""
+    share_key = shared_turn_key(session, user_input)
+    if share_key is None:
+        return await arun_chain(session, user_input)
+
+    caching = response_cache is not None or semantic_cache is not None
+    if caching:
+        # The semantic cache embeds and queries Milvus synchronously.
+        cached = await run_in_threadpool(lookup_cached_response, share_key)
+        if cached is not None:
+            await session.memory.asave_context({"input": user_input}, {"response": cached})
+            return cached
+
+    async def leader():
+        response = await arun_chain(session, user_input)
+        return response, is_shareable_response(session, response)
+
+    if COALESCE_ENABLED:
+        (generated_response, shareable), shared = await inflight.ado(share_key, leader)
+    else:
+        (generated_response, shareable), shared = await leader(), False
+    if shared:
+        if shareable:
+            await session.memory.asave_context(
+                {"input": user_input}, {"response": generated_response}
+            )
+        else:
+            generated_response = await arun_chain(session, user_input)
+    if caching:
+        await run_in_threadpool(store_cached_response, share_key, session, generated_response)
+    return generated_response
 
 
 def is_response_uncertain(response: str) -> bool:
-    uncertainty_indicators = [
-        "i'm not sure",
-        "uncertain",
-        "i don't have enough information",
-    ]
-    return any(ind in response.lower() for ind in uncertainty_indicators)
+    return safety_matcher.matches(response, "uncertain")
 
 
 def is_sensitive_query(user_input: str) -> bool:
-    sensitive_keywords = ["suicide", "self-harm", "harm myself", "i feel hopeless"]
-    return any(word in user_input.lower() for word in sensitive_keywords)
+    return safety_matcher.matches(user_input, "sensitive")
+
 
+def fallback_response(
+    user_input: str, generated_response: str, input_flags: Optional[Set[str]] = None
+) -> str:
+    """Replace the model output when the input is sensitive or the answer is uncertain.
 
-def fallback_response(user_input: str, generated_response: str) -> str:
-    if is_sensitive_query(user_input):
-        return "I'm sorry you're experiencing these feelings. Please consider reaching out to a trusted healthcare provider or crisis intervention service immediately."
+    `input_flags` are the safety categories of `user_input` if the caller already matched it.
+    """
+    if input_flags is None:
+        input_flags = safety_matcher.match(user_input)
+    if "sensitive" in input_flags:
+        return SENSITIVE_RESPONSE
     elif is_response_uncertain(generated_response):
-        return "I'm not completely sure about that. It would be best to consult a healthcare professional for personalized advice."
+        return UNCERTAIN_RESPONSE
     return generated_response
 
 
 def check_for_emergency(input_text: str) -> bool:
-    emergency_keywords = [
-        "emergency",
-        "chest pain",
-        "severe",
-        "unconscious",
-        "difficulty breathing",
-        "shortness of breath",
-    ]
-    return any(keyword in input_text.lower() for keyword in emergency_keywords)
+    return safety_matcher.matches(input_text, "emergency")
 
 
 # -------------------------------
 # FastAPI Setup
 # -------------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup.start()
+    yield
+    if history_backend is not None:
+        # The log backend indexes what it appended, so the next start need not scan it.
+        history_backend.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # TODO: Adjust for production
@@ -146,57 +794,427 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(ClientDisconnected)
+def disconnected_handler(request, exc: ClientDisconnected):
+    # Nobody is listening any more; 499 is the conventional "client closed request".
+    return Response(status_code=499)
+
+
+@app.exception_handler(NotReady)
+def not_ready_handler(request, exc: NotReady):
+    return JSONResponse(
+        status_code=503,
+        content={"response": BUSY_RESPONSE, "detail": str(exc)},
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.exception_handler(Overloaded)
+def overloaded_handler(request, exc: Overloaded):
+    return JSONResponse(
+        status_code=429,
+        content={"response": BUSY_RESPONSE, "detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 # -------------------------------
 # Pydantic Models
 # -------------------------------
 class ChatRequest(BaseModel):
     user_input: str
     profile: Optional[dict] = None
+    # Sent instead of `profile` once the server has returned its fingerprint.
+    profile_fingerprint: Optional[str] = None
+    session_id: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
     response: str
+    history_tokens: Optional[int] = None
+    profile_fingerprint: Optional[str] = None
+
+
+class BatchItem(ChatRequest):
+    # Echoed back so callers can match results, which arrive in completion order.
+    id: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None
 
 
 # -------------------------------
 # Endpoints
 # -------------------------------
 @app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(chat_request: ChatRequest):
+async def chat_endpoint(chat_request: ChatRequest, request: Request):
+    """Run the turn in the threadpool and abort its model call if the client disconnects."""
+    cancel = CancellationHandler()
+    return await cancel_on_disconnect(
+        request,
+        run_in_threadpool(chat_turn, chat_request, cancel),
+        on_disconnect=cancel.event.set,
+    )
+
+
+def chat_turn(chat_request: ChatRequest, cancel: CancellationHandler) -> ChatResponse:
     user_input = chat_request.user_input
     print(f"User input: {user_input}")
+    warmup.wait(WARMUP_TIMEOUT)
 
-    # If a new profile is provided, update the conversation memory.
-    if chat_request.profile:
-        print("Profile provided. Updating memory with new profile data.")
-        insert_profile_into_memory(chat_request.profile)
-    else:
-        print("No profile provided with this request.")
+    profile = hydrate_profile(chat_request)
+    session = request_session(chat_request)
+    with session.lock:
+        try:
+            # If a new profile is provided, update the conversation memory.
+            prepare_session(session, profile)
 
-    # Check for emergency keywords in the user input.
-    if check_for_emergency(user_input):
-        return ChatResponse(
-            response="It sounds like you may be experiencing an emergency. Please seek immediate medical assistance or call your local emergency services."
+            # Check for emergency keywords in the user input.
+            input_flags = safety_matcher.match(user_input)
+            if "emergency" in input_flags:
+                return ChatResponse(response=EMERGENCY_RESPONSE)
+
+            try:
+                generated_response = predict_turn(session, user_input, cancel)
+                print("Generated response:", generated_response)
+                history_tokens = history_token_count(session.memory)
+            except (Overloaded, ClientDisconnected):
+                raise
+            except Exception as e:
+                print("Error during prediction:", e)
+                return ChatResponse(response=ERROR_RESPONSE)
+        finally:
+            session_store.update(session)
+
+    final_response = fallback_response(user_input, generated_response, input_flags)
+    return ChatResponse(
+        response=final_response,
+        history_tokens=history_tokens,
+        profile_fingerprint=chat_request.profile_fingerprint,
+    )
+
+
+@app.post("/chat/async", response_model=ChatResponse)
+async def achat_endpoint(chat_request: ChatRequest, request: Request):
+    """Same as /chat, but awaits the model on the event loop instead of holding a threadpool thread."""
+    return await cancel_on_disconnect(request, achat_turn(chat_request))
+
+
+async def achat_turn(chat_request: ChatRequest, session: Optional[Session] = None) -> ChatResponse:
+    user_input = chat_request.user_input
+    print(f"User input (async): {user_input}")
+    if not warmup.ready:
+        await run_in_threadpool(warmup.wait, WARMUP_TIMEOUT)
+
+    profile = hydrate_profile(chat_request)
+    if session is None:
+        session = request_session(chat_request)
+    async with session.async_lock():
+        try:
+            if session.history is not None:
+                # Reading and writing the shared history blocks.
+                await run_in_threadpool(prepare_session, session, profile)
+            else:
+                prepare_session(session, profile)
+
+            input_flags = safety_matcher.match(user_input)
+            if "emergency" in input_flags:
+                return ChatResponse(response=EMERGENCY_RESPONSE)
+
+            try:
+                generated_response = await apredict_turn(session, user_input)
+                print("Generated response:", generated_response)
+                history_tokens = history_token_count(session.memory)
+            except (Overloaded, ClientDisconnected):
+                raise
+            except Exception as e:
+                print("Error during prediction:", e)
+                return ChatResponse(response=ERROR_RESPONSE)
+        finally:
+            session_store.update(session)
+
+    final_response = fallback_response(user_input, generated_response, input_flags)
+    return ChatResponse(
+        response=final_response,
+        history_tokens=history_tokens,
+        profile_fingerprint=chat_request.profile_fingerprint,
+    )
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def usage_data(session: Session, chat_request: ChatRequest) -> dict:
+    return {
+        "history_tokens": history_token_count(session.memory),
+        "profile_fingerprint": chat_request.profile_fingerprint,
+    }
+
+
+def stream_chat_events(
+    session: Session,
+    chat_request: ChatRequest,
+    profile: Optional[RenderedProfile],
+    cancel: Optional[CancellationHandler] = None,
+):
+    """Generate the SSE events of one chat turn; the caller must hold `session.lock`.
+
+    `cancel` aborts the model call, with ClientDisconnected, once its event is set.
+    """
+    user_input = chat_request.user_input
+    prepare_session(session, profile)
+
+    # The pre-checks only depend on the input, so they answer without calling the model.
+    input_flags = safety_matcher.match(user_input)
+    if "emergency" in input_flags:
+        yield sse_event("replace", {"response": EMERGENCY_RESPONSE})
+        return
+    if "sensitive" in input_flags:
+        session.memory.save_context(
+            {"input": user_input}, {"response": SENSITIVE_RESPONSE}
         )
+        yield sse_event("replace", {"response": SENSITIVE_RESPONSE})
+        return
 
+    cache_key = None
+    if response_cache is not None or semantic_cache is not None:
+        cache_key = shared_turn_key(session, user_input)
+    cached = lookup_cached_response(cache_key) if cache_key is not None else None
+    if cached is not None:
+        session.memory.save_context({"input": user_input}, {"response": cached})
+        final_response = fallback_response(user_input, cached, input_flags)
+        yield sse_event("token", {"token": final_response})
+        yield sse_event("usage", usage_data(session, chat_request))
+        return
+
+    history = session.memory.load_memory_variables({})["history"]
+    context = session.context_memory.load_memory_variables({"input": user_input})["context"]
+    prompt_text = prompt.format(history=history, context=context, input=user_input)
+    generated_response = ""
     try:
-        generated_response = conversation_with_memory.predict(input=user_input)
-        print("Generated response:", generated_response)
+        with admission.slot():
+            callbacks = [cancel] if cancel is not None else None
+            for chunk in llm.stream(prompt_text, config={"callbacks": callbacks}):
+                generated_response += chunk
+                tail = generated_response[-(len(chunk) + UNCERTAINTY_WINDOW) :]
+                if is_response_uncertain(tail):
+                    # Stop generating; the rest of the answer would be replaced anyway.
+                    generated_response = UNCERTAIN_RESPONSE
+                    yield sse_event("replace", {"response": UNCERTAIN_RESPONSE})
+                    break
+                yield sse_event("token", {"token": chunk})
+    except GeneratorExit:
+        # The client disconnected; unwinding closes llm.stream, which aborts the upstream request.
+        cancelled_calls.inc()
+        raise
+    except ClientDisconnected:
+        raise
+    except Overloaded as e:
+        # The stream has already started, so the 429 is reported in-band.
+        yield sse_event("replace", {"response": BUSY_RESPONSE, "retry_after": e.retry_after})
+        return
     except Exception as e:
-        print("Error during prediction:", e)
-        return ChatResponse(response="An error occurred processing your request.")
+        print("Error during streaming prediction:", e)
+        yield sse_event("replace", {"response": ERROR_RESPONSE})
+        return
 
-    final_response = fallback_response(user_input, generated_response)
-    return ChatResponse(response=final_response)
+    print("Generated response:", generated_response)
+    session.memory.save_context({"input": user_input}, {"response": generated_response})
+    if cache_key is not None and generated_response != UNCERTAIN_RESPONSE:
+        store_cached_response(cache_key, session, generated_response)
+    yield sse_event("usage", usage_data(session, chat_request))
+
+
+@app.post("/chat/stream")
+def chat_stream_endpoint(chat_request: ChatRequest, request: Request):
+    """Stream the reply as server-sent events while the model generates it.
+
+    Events: `token` carries the next chunk of text, `replace` tells the client to
+    replace everything received so far with a canned reply, `usage` reports the
+    history token count after the turn and the profile fingerprint, and `done`
+    ends the stream.
+    """
+    print(f"User input (stream): {chat_request.user_input}")
+    warmup.wait(WARMUP_TIMEOUT)
+    profile = hydrate_profile(chat_request)
+    session = request_session(chat_request)
+
+    cancel = CancellationHandler()
+
+    def session_events():
+        try:
+            with session.lock:
+                try:
+                    yield from stream_chat_events(session, chat_request, profile, cancel)
+                finally:
+                    session_store.update(session)
+            yield sse_event("done", {})
+        except (GeneratorExit, ClientDisconnected):
+            disconnects.inc()
+            raise
+
+    def next_event():
+        try:
+            return next(iterator, None)
+        except ClientDisconnected:
+            return None
+
+    async def events():
+        # Writes to a closed connection are silently dropped, so poll for the
+        # disconnect between events and stop the model.
+        pending = None
+        try:
+            while True:
+                # Shielded, so a cancellation by Starlette does not abandon the
+                # worker thread while it is still inside the generator.
+                pending = asyncio.ensure_future(run_in_threadpool(next_event))
+                event = await asyncio.shield(pending)
+                pending = None
+                if event is None:
+                    break
+                yield event
+                if await request.is_disconnected():
+                    break
+        finally:
+            # A generator cannot be closed while a thread is running it: make the
+            # model call stop at its next token and wait for that thread first.
+            cancel.event.set()
+            if pending is not None:
+                await asyncio.wait({pending})
+            await run_in_threadpool(iterator.close)
+
+    iterator = session_events()
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def answer_batch_item(index: int, item: BatchItem) -> dict:
+    """Answer one batch item like /chat/async and render it as a result line."""
+    result = {"index": index, "id": item.id}
+    session = None
+    for attempt in range(BATCH_OVERLOAD_RETRIES + 1):
+        try:
+            if session is None and not item.session_id:
+                # Items without a session id get a throwaway session, so a batch never
+                # writes into the live conversation of the patient whose profile it uses.
+                # Creating it needs the warm LLM and prompt.
+                await run_in_threadpool(warmup.wait, WARMUP_TIMEOUT)
+                session = create_session(f"batch:{index}", persistent=False)
+            reply = await achat_turn(item, session)
+            result.update(
+                response=reply.response,
+                history_tokens=reply.history_tokens,
+                profile_fingerprint=reply.profile_fingerprint,
+            )
+            return result
+        except Overloaded as e:
+            if attempt == BATCH_OVERLOAD_RETRIES:
+                result.update(response=BUSY_RESPONSE, error="overloaded", retry_after=e.retry_after)
+                return result
+            await asyncio.sleep(e.retry_after)
+        except HTTPException as e:
+            result.update(response=ERROR_RESPONSE, error=e.detail)
+            return result
+        except NotReady as e:
+            result.update(response=ERROR_RESPONSE, error=str(e))
+            return result
+        except Exception as e:
+            print(f"Error answering batch item {index}:", e)
+            result.update(response=ERROR_RESPONSE, error="failed")
+            return result
+
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(batch: BatchRequest):
+    """Answer many questions, streaming one NDJSON line per item as soon as it is done.
+
+    Items run through the same safety checks, caches and fallbacks as /chat;
+    at most `concurrency` of them are in flight at once.
+    """
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch.")
+    concurrency = max(1, min(batch.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    print(f"Batch of {len(batch.items)} items, concurrency {concurrency}")
+
+    async def lines():
+        pending = iter(enumerate(batch.items))
+        results: "asyncio.Queue[dict]" = asyncio.Queue()
+
+        async def worker():
+            for index, item in pending:
+                await results.put(await answer_batch_item(index, item))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+        try:
+            for _ in batch.items:
+                yield json.dumps(await results.get()) + "\n"
+        finally:
+            # Stops the remaining items if the client goes away.
+            for task in workers:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    """Readiness probe: 200 once every required startup step is warm, 503 before that or after a failure."""
+    if warmup.ready:
+        status = "ok"
+    else:
+        status = "failed" if warmup.failed else "warming"
+    return JSONResponse(
+        status_code=200 if warmup.ready else 503,
+        content={"status": status, "components": warmup.status},
+    )
+
+
+@app.get("/startup")
+def startup_report():
+    """How long importing this module and each warmup step took.
+
+    With AGENT_STARTUP_PROFILE=1 it also lists the slowest imports, like `python -X importtime`.
+    """
+    return {
+        "import_seconds": IMPORT_SECONDS,
+        "warmup": warmup.status,
+        "slowest_imports": import_profiler.top(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    report = {
+        "sessions": session_store.stats(),
+        "llm_admission": admission.stats(),
+        "llm_transport": retry_policy.stats(),
+        "profiles": profile_registry.stats(),
+        **registry.snapshot(),
+    }
+    if response_cache is not None:
+        report["response_cache"] = response_cache.stats()
+    if hedger is not None:
+        report["llm_hedging"] = hedger.stats()
+    if history_backend is not None:
+        report["history"] = history_backend.stats()
+    if EMBEDDING_CACHE_ENABLED and embeddings is not None:
+        report["embedding_cache"] = embeddings.stats()
+    return report
 
 
 # -------------------------------
 # Main
 # -------------------------------
+IMPORT_SECONDS = round(time.perf_counter() - IMPORT_STARTED, 3)
+print(f"Agent module imported in {IMPORT_SECONDS}s; warmup starts with the server.")
+
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,106 @@
+"""On-disk cache of text extracted from PDF files, keyed by the file's SHA-256.
+
+Run it at image build time so the agent never parses a PDF on startup:
+
+    python pdf_cache.py crestor_eng.pdf
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import pdf_extract
+
+CACHE_DIR = os.getenv(
+    "AGENT_PDF_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pdf_cache"),
+)
+# Bump when the extraction changes so stale entries are ignored.
+CACHE_VERSION = 1
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(sha256: str, cache_dir: Optional[str] = None) -> str:
+    return os.path.join(cache_dir or CACHE_DIR, f"{sha256}.json")
+
+
+def read_cached(sha256: str, cache_dir: Optional[str] = None) -> Optional[List[str]]:
+    try:
+        with open(cache_path(sha256, cache_dir), "r", encoding="utf-8") as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if entry.get("version") != CACHE_VERSION:
+        return None
+    return entry["pages"]
+
+
+def write_cached(sha256: str, source: str, pages: List[str], cache_dir: Optional[str] = None):
+    directory = cache_dir or CACHE_DIR
+    os.makedirs(directory, exist_ok=True)
+    entry = {"version": CACHE_VERSION, "source": os.path.basename(source), "pages": pages}
+    # Write to a temporary file first so readers never see a half-written entry.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, cache_path(sha256, directory))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_pages(path: str, cache_dir: Optional[str] = None) -> List[str]:
+    """Return the page texts of `path`, parsing the PDF only if it is not cached yet."""
+    sha256 = file_sha256(path)
+    pages = read_cached(sha256, cache_dir)
+    if pages is None:
+        pages = pdf_extract.extract_pages(path)
+        try:
+            write_cached(sha256, path, pages, cache_dir)
+        except OSError as e:
+            print(f"Could not cache extracted text of {path}: {e}")
+    return pages
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Prewarm the PDF text cache.")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories to extract")
+    parser.add_argument("--cache-dir", default=None, help=f"default: {CACHE_DIR}")
+    parser.add_argument(
+        "--missing-ok", action="store_true", help="skip files that do not exist"
+    )
+    args = parser.parse_args(argv)
+
+    status = 0
+    for path in pdf_extract.find_pdfs(args.paths):
+        if not os.path.exists(path):
+            print(f"{path}: not found")
+            if not args.missing_ok:
+                status = 1
+            continue
+        start = time.perf_counter()
+        try:
+            pages = load_pages(path, args.cache_dir)
+        except Exception as e:
+            print(f"{path}: {e}")
+            status = 1
+            continue
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{path}: {len(pages)} pages cached in {elapsed:.0f} ms")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from metrics import registry
+
+# Profile attributes that shape the answer without identifying the patient.
+CLINICAL_FIELDS = ("age", "diagnosis", "medicine", "recommended_activities")
+
+
+def profile_fingerprint(profile: Optional[dict], fields: Optional[Iterable[str]] = None) -> str:
+    """Stable content hash of a profile (or of the given subset of its fields)."""
+    if not profile:
+        return "none"
+    if fields is not None:
+        profile = {field: profile.get(field) for field in fields}
+    canonical = json.dumps(profile, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+class RenderedProfile(NamedTuple):
+    profile: dict
+    fingerprint: str
+    # Hash of CLINICAL_FIELDS only, for sharing answers between patients.
+    clinical_fingerprint: str
+    text: str
+    takes_crestor: bool
+
+
+class ProfileRegistry:
+    """Bounded LRU of profiles by fingerprint, each with its rendered prompt text.
+
+    A client that has sent a profile once can identify it by fingerprint alone
+    afterwards; `get` returns None once the entry has been evicted, and the
+    client then has to send the full profile again.
+    """
+
+    def __init__(self, render: Callable[[dict], Tuple[str, bool]], max_entries: int = 1000):
+        self.render = render
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, RenderedProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = registry.counter("profile_cache_hits_total")
+        self._misses = registry.counter("profile_cache_misses_total")
+        self._unknown = registry.counter("profile_fingerprint_unknown_total")
+
+    def get(self, fingerprint: str) -> Optional[RenderedProfile]:
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                self._unknown.inc()
+                return None
+            self._entries.move_to_end(fingerprint)
+            self._hits.inc()
+            return entry
+
+    def register(self, profile: dict) -> RenderedProfile:
+        """Return the entry for `profile`, rendering it on a miss."""
+        fingerprint = profile_fingerprint(profile)
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                self._entries.move_to_end(fingerprint)
+                self._hits.inc()
+                return entry
+        self._misses.inc()
+        text, takes_crestor = self.render(profile)
+        entry = RenderedProfile(
+            profile, fingerprint, profile_fingerprint(profile, CLINICAL_FIELDS), text, takes_crestor
+        )
+        with self._lock:
+            self._entries[fingerprint] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries}
@@ -0,0 +1,165 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+from langchain_core.prompts import PromptTemplate
+
+from metrics import registry
+
+# Separates retrieved chunks in the {context} variable, so they can be dropped one by one.
+CHUNK_SEPARATOR = "\n---\n"
+
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class Tokenizer:
+    """tiktoken encoding for the model, or a ~4 characters per token estimate if it is unavailable."""
+
+    def __init__(self, model_name: str = "gpt-3.5-turbo-instruct"):
+        self.encoding = None
+        try:
+            import tiktoken
+
+            try:
+                self.encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Tokenizer for {model_name} unavailable, estimating token counts: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keep the first `max_tokens` tokens of `text`."""
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            return text[: max_tokens * 4]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+
+def _group_turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    """Group messages into units that are kept or dropped together (a turn or a summary)."""
+    groups: List[List[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, (HumanMessage, SystemMessage)) or not groups:
+            groups.append([message])
+        else:
+            groups[-1].append(message)
+    return groups
+
+
+class PromptBudgeter:
+    """Counts the tokens of each prompt segment and trims them to fit `max_tokens`.
+
+    Segments are `template` (the fixed text), `profile` (the pinned profile turn),
+    `history`, `context` (retrieved label chunks) and `input`. When the prompt is
+    too large, segments are trimmed in `trim_order`: by default the oldest history
+    turns first (the latest turn is kept as long as possible), then the lowest
+    ranked context chunks, then the tail of the profile. The input is never cut.
+    Message histories are rendered as "Human: ... / AI: ..." lines.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        max_tokens: int,
+        trim_order: Sequence[str] = ("history", "context", "profile"),
+        pinned_inputs: Tuple[str, ...] = ("Profile",),
+    ):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.trim_order = tuple(trim_order)
+        self.pinned_inputs = pinned_inputs
+
+    def fit(self, template: PromptTemplate, variables: Dict[str, Any]) -> Dict[str, Any]:
+        """Return `variables` with history and context rendered as text and trimmed to the budget."""
+        count = self.tokenizer.count
+        variables = dict(variables)
+        history = variables.get("history", "")
+        context = variables.get("context", "")
+
+        profile = ""
+        turns: List[str] = []
+        if isinstance(history, str):
+            # Plain-text history cannot be split into turns; it is kept or dropped as a whole.
+            turns = [history] if history else []
+        else:
+            for group in _group_turns(history):
+                if group[0].content in self.pinned_inputs:
+                    profile = get_buffer_string(group)
+                else:
+                    turns.append(get_buffer_string(group))
+        chunks = [c for c in context.split(CHUNK_SEPARATOR) if c] if context else []
+
+        # Format with the base class so a BudgetedPromptTemplate does not budget itself.
+        empty = {name: "" for name in template.input_variables}
+        template_tokens = count(PromptTemplate.format(template, **empty))
+        input_tokens = count(variables.get("input", ""))
+        fixed = template_tokens + input_tokens
+        turn_tokens = [count(turn) for turn in turns]
+        chunk_tokens = [count(chunk) for chunk in chunks]
+        profile_tokens = count(profile)
+
+        def total() -> int:
+            return fixed + profile_tokens + sum(turn_tokens) + sum(chunk_tokens)
+
+        def trim(segment: str, keep_turns: int) -> bool:
+            nonlocal profile, profile_tokens
+            trimmed = False
+            if segment == "history":
+                while len(turns) > keep_turns and total() > self.max_tokens:
+                    turns.pop(0)
+                    turn_tokens.pop(0)
+                    trimmed = True
+            elif segment == "context":
+                while chunks and total() > self.max_tokens:
+                    chunks.pop()
+                    chunk_tokens.pop()
+                    trimmed = True
+            elif segment == "profile" and profile:
+                overflow = total() - self.max_tokens
+                profile = self.tokenizer.truncate(profile, profile_tokens - overflow)
+                profile_tokens = count(profile)
+                trimmed = True
+            return trimmed
+
+        for segment in self.trim_order:
+            if total() <= self.max_tokens:
+                break
+            if trim(segment, keep_turns=1):
+                registry.counter(f"prompt_trimmed_{segment}_total").inc()
+        # Last resort: drop the latest turn as well.
+        if total() > self.max_tokens and trim("history", keep_turns=0):
+            registry.counter("prompt_trimmed_history_total").inc()
+
+        variables["history"] = "\n".join(([profile] if profile else []) + turns)
+        variables["context"] = CHUNK_SEPARATOR.join(chunks)
+
+        segments = {
+            "template": template_tokens,
+            "input": input_tokens,
+            "profile": profile_tokens,
+            "history": sum(turn_tokens),
+            "context": sum(chunk_tokens),
+            "total": total(),
+        }
+        for segment, value in segments.items():
+            registry.histogram(f"prompt_tokens_{segment}", TOKEN_BUCKETS).observe(value)
+        return variables
+
+
+class BudgetedPromptTemplate(PromptTemplate):
+    """PromptTemplate that runs its variables through a PromptBudgeter before formatting."""
+
+    budgeter: Optional[Any] = None
+
+    def format(self, **kwargs: Any) -> str:
+        if self.budgeter is not None:
+            kwargs = self.budgeter.fit(self, kwargs)
+        return super().format(**kwargs)
@@ -0,0 +1,67 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from metrics import registry
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Casefold, collapse whitespace and drop trailing punctuation."""
+    return _WHITESPACE.sub(" ", text.casefold()).strip().rstrip("?!. ")
+
+
+class ResponseCache:
+    """Exact-match cache of model answers with a TTL and LRU size bound.
+
+    Keys are built by the caller from the normalized question, the profile
+    fingerprint and the prompt template version, so a template change or a
+    different profile never serves a stale answer.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600.0, name: str = "response_cache"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = registry.counter(f"{name}_hits_total")
+        self._misses = registry.counter(f"{name}_misses_total")
+        self._evictions = registry.counter(f"{name}_evictions_total")
+
+    @staticmethod
+    def key(question: str, fingerprint: str, version: str) -> Tuple[str, str, str]:
+        return normalize_question(question), fingerprint, version
+
+    def get(self, key: Tuple) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                    self._evictions.inc()
+                self._misses.inc()
+                return None
+            self._entries.move_to_end(key)
+            self._hits.inc()
+            return entry[1]
+
+    def put(self, key: Tuple, response: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions.inc()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries}
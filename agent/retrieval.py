@@ -0,0 +1,244 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.memory import BaseMemory
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from bm25 import BM25Index
+from metrics import registry
+from prompt_budget import CHUNK_SEPARATOR
+
+# Vector searches run here while the calling thread searches the lexical index.
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+vector_ms = registry.histogram("retrieval_vector_ms")
+lexical_ms = registry.histogram("retrieval_lexical_ms")
+fusion_ms = registry.histogram("retrieval_fusion_ms")
+search_ms = registry.histogram("retrieval_ms")
+vector_errors = registry.counter("retrieval_vector_errors_total")
+
+
+def chunk_pages(
+    pages: Sequence[str], source: str, chunk_size: int = 1000, chunk_overlap: int = 150
+) -> List[Document]:
+    """Split page texts into overlapping chunks that remember their source and page."""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    chunks = []
+    for page_number, page_text in enumerate(pages, start=1):
+        for index, text in enumerate(splitter.split_text(page_text)):
+            chunks.append(
+                Document(
+                    page_content=text,
+                    metadata={"source": source, "page": page_number, "chunk": index},
+                )
+            )
+    return chunks
+
+
+def chunk_id(chunk: Document) -> str:
+    """Primary key of a chunk, from its source and text.
+
+    An unchanged chunk keeps its id when a label is re-ingested, even if it moved
+    to another page, and a changed one gets a new id, which is how ingestion
+    tells what to embed and delete. The page is only metadata.
+    """
+    key = f"{chunk.metadata['source']}:{chunk.page_content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def document_key(document: Document) -> str:
+    """Identity of a chunk across retrievers: its chunk id, or a hash of its text."""
+    if "source" in document.metadata:
+        return chunk_id(document)
+    return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()[:32]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Document]], k: int, rrf_k: int = 60
+) -> List[Document]:
+    """Merge ranked lists by summing 1 / (rrf_k + rank) per chunk; ties keep the earlier list's order."""
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+
+def format_documents(documents: Sequence[Document]) -> str:
+    """Render retrieved chunks for the prompt, each followed by its citation, best match first."""
+    return CHUNK_SEPARATOR.join(
+        f"{doc.page_content}\n[Source: {doc.metadata.get('source')}, page {doc.metadata.get('page')}]"
+        for doc in documents
+    )
+
+
+class LabelRetriever:
+    """Top-k search over drug-label chunks stored in a Milvus collection.
+
+    On first use the collection is brought in sync with `pages_loader`: chunks
+    of pages that changed since the last ingestion recorded in `manifest_path`
+    are embedded and replaced, so a fresh deployment needs no separate
+    ingestion step and an unchanged label costs nothing.
+
+    With `hybrid`, a BM25 index over the same chunks is searched alongside the
+    vector search, and the top `candidates` of both are merged by reciprocal
+    rank fusion. Exact terms such as drug names, doses ("40 mg") and lab markers
+    ("CK") that embeddings blur then still find their chunk.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        collection_name: str,
+        embeddings,
+        source: str,
+        pages_loader: Callable[[], Sequence[str]],
+        k: int = 4,
+        hybrid: bool = False,
+        candidates: int = 20,
+        rrf_k: int = 60,
+        manifest_path: Optional[str] = None,
+    ):
+        self.uri = uri
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.source = source
+        self.pages_loader = pages_loader
+        self.k = k
+        self.hybrid = hybrid
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.manifest_path = manifest_path
+        self._store = None
+        self._lexical: Optional[BM25Index] = None
+        self._lock = threading.Lock()
+
+    def _vector_store(self):
+        if self._store is not None:
+            return self._store
+        with self._lock:
+            if self._store is None:
+                from langchain_milvus import Milvus
+
+                store = Milvus(
+                    embedding_function=self.embeddings,
+                    collection_name=self.collection_name,
+                    connection_args={"uri": self.uri},
+                    auto_id=False,
+                )
+                self._ingest(store, self.pages_loader())
+                self._store = store
+        return self._store
+
+    def _lexical_index(self) -> BM25Index:
+        if self._lexical is not None:
+            return self._lexical
+        with self._lock:
+            if self._lexical is None:
+                self._lexical = BM25Index(chunk_pages(self.pages_loader(), self.source))
+        return self._lexical
+
+    def _ingest(self, store, pages: Sequence[str], force: bool = False) -> int:
+        from ingestion import LabelIngestor
+
+        ingestor = LabelIngestor(store, self.manifest_path, uri=self.uri)
+        result = ingestor.sync(self.source, pages, force=force)
+        if self.hybrid:
+            self._lexical = BM25Index(chunk_pages(pages, self.source))
+        if result.skipped:
+            print(f"{self.source} is unchanged in {self.collection_name}.")
+        else:
+            print(
+                f"Ingested {self.source} into {self.collection_name}: {result.added} chunks added, "
+                f"{result.deleted} deleted, {result.moved} moved, {result.unchanged} unchanged."
+            )
+        return result.added
+
+    def connect(self):
+        """Open the collection now (ingesting the label if it is empty) instead of on the first search."""
+        self._vector_store()
+        if self.hybrid:
+            self._lexical_index()
+
+    def ingest(self, pages: Sequence[str]) -> int:
+        """Sync the collection with the given pages; return the number of chunks embedded."""
+        return self._ingest(self._vector_store(), pages, force=True)
+
+    def vector_search(self, query: str, k: int) -> List[Document]:
+        started = time.perf_counter()
+        try:
+            return self._vector_store().similarity_search(query, k=k)
+        finally:
+            vector_ms.observe((time.perf_counter() - started) * 1000)
+
+    def lexical_search(self, query: str, k: int) -> List[Document]:
+        started = time.perf_counter()
+        try:
+            return [document for document, _ in self._lexical_index().search(query, k)]
+        finally:
+            lexical_ms.observe((time.perf_counter() - started) * 1000)
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Document]:
+        k = k or self.k
+        started = time.perf_counter()
+        if not self.hybrid:
+            documents = self.vector_search(query, k)
+            search_ms.observe((time.perf_counter() - started) * 1000)
+            return documents
+
+        vector = _search_executor.submit(self.vector_search, query, max(k, self.candidates))
+        lexical = self.lexical_search(query, max(k, self.candidates))
+        try:
+            rankings = [vector.result(), lexical]
+        except Exception as e:
+            # Exact-term matches are still worth answering with while Milvus is down.
+            print(f"Vector search failed, using lexical matches only: {e}")
+            vector_errors.inc()
+            rankings = [lexical]
+        fusing = time.perf_counter()
+        documents = reciprocal_rank_fusion(rankings, k, self.rrf_k)
+        fusion_ms.observe((time.perf_counter() - fusing) * 1000)
+        search_ms.observe((time.perf_counter() - started) * 1000)
+        return documents
+
+
+class LabelContextMemory(BaseMemory):
+    """Read-only memory that exposes the label chunks relevant to the current input.
+
+    Plugging retrieval in as a memory variable lets ConversationChain fill the
+    `{context}` slot of the prompt without any change to how it is called.
+    """
+
+    retriever: Any = None
+    enabled: bool = False
+    memory_key: str = "context"
+    input_key: str = "input"
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, str]:
+        if not self.enabled or self.retriever is None:
+            return {self.memory_key: ""}
+        try:
+            documents = self.retriever.search(inputs[self.input_key])
+        except Exception as e:
+            print(f"Error retrieving label context: {e}")
+            return {self.memory_key: ""}
+        return {self.memory_key: format_documents(documents)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
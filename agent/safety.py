@@ -0,0 +1,84 @@
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+KEYWORDS_PATH = os.getenv(
+    "AGENT_SAFETY_KEYWORDS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "safety_keywords.json"),
+)
+
+# Typographic apostrophes are folded so "I’m not sure" matches "i'm not sure".
+_FOLD = str.maketrans({"’": "'", "‘": "'", "ʼ": "'"})
+
+
+def normalize(text: str) -> str:
+    return text.translate(_FOLD).casefold()
+
+
+def _trie_pattern(node: dict) -> str:
+    """Render a character trie as a regex that prefers the longest term at each position."""
+    alternatives = [
+        re.escape(char) + _trie_pattern(child)
+        for char, child in sorted(node.items())
+        if char != ""
+    ]
+    if not alternatives:
+        return ""
+    if len(alternatives) == 1 and "" not in node:
+        return alternatives[0]
+    group = "(?:" + "|".join(alternatives) + ")"
+    return group + "?" if "" in node else group
+
+
+class SafetyMatcher:
+    """Match text against every keyword category in a single pass.
+
+    All terms are compiled into one trie-shaped regex, so the cost of a scan
+    grows with the length of the text, not with the number of terms or
+    categories. A term matches anywhere in the text, like a substring test:
+    "chest pain" also flags "chest pains" and "self-harm" "self-harming".
+    Missing a safety keyword costs more than a spurious canned reply.
+    """
+
+    def __init__(self, categories: Dict[str, Iterable[str]]):
+        self._terms: Dict[str, Set[str]] = {}
+        trie: dict = {}
+        for category, terms in categories.items():
+            for term in terms:
+                term = normalize(term.strip())
+                if not term:
+                    continue
+                self._terms.setdefault(term, set()).add(category)
+                node = trie
+                for char in term:
+                    node = node.setdefault(char, {})
+                node[""] = {}
+        self.categories = list(categories)
+        self.max_term_length = max((len(term) for term in self._terms), default=0)
+        # The lookahead lets matches overlap, so a term inside a longer one is still seen.
+        body = _trie_pattern(trie) or "(?!)"
+        self._pattern = re.compile(rf"(?=({body}))")
+
+    def match(self, text: str) -> Set[str]:
+        """Return the names of all categories with at least one term in `text`."""
+        folded = normalize(text)
+        found: Set[str] = set()
+        for m in self._pattern.finditer(folded):
+            longest = m.group(1)
+            # Shorter terms that are prefixes of the longest match at this position also count.
+            for length in range(1, len(longest) + 1):
+                found.update(self._terms.get(longest[:length], ()))
+        return found
+
+    def matches(self, text: str, category: str) -> bool:
+        return category in self.match(text)
+
+
+def load_keywords(path: Optional[str] = None) -> Dict[str, List[str]]:
+    with open(path or KEYWORDS_PATH, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def load_matcher(path: Optional[str] = None) -> SafetyMatcher:
+    return SafetyMatcher(load_keywords(path))
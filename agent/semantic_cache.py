@@ -0,0 +1,119 @@
+import threading
+import time
+from typing import Optional
+
+from metrics import registry
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.95, 0.98, 1.0)
+
+
+class SemanticResponseCache:
+    """Answers to paraphrased questions, looked up by embedding similarity in Milvus.
+
+    An entry is served only if its profile fingerprint and prompt version match
+    exactly, it has not expired, and the cosine similarity of the questions is at
+    least `threshold`. Errors are treated as misses so a Milvus outage never
+    fails a chat request.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        collection_name: str,
+        embeddings,
+        threshold: float = 0.92,
+        ttl: float = 3600.0,
+        purge_every: int = 100,
+    ):
+        self.uri = uri
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._client = None
+        self._ready = False
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._hits = registry.counter("semantic_cache_hits_total")
+        self._misses = registry.counter("semantic_cache_misses_total")
+        self._errors = registry.counter("semantic_cache_errors_total")
+        self._latency = registry.histogram("semantic_cache_lookup_ms", LATENCY_BUCKETS_MS)
+        self._similarity = registry.histogram("semantic_cache_similarity", SIMILARITY_BUCKETS)
+
+    def _collection(self, dimension: int):
+        """Connect and create the collection on first use, once the vector size is known."""
+        if self._ready:
+            return self._client
+        with self._lock:
+            if self._client is None:
+                from pymilvus import MilvusClient
+
+                self._client = MilvusClient(uri=self.uri)
+            if not self._client.has_collection(self.collection_name):
+                self._client.create_collection(
+                    self.collection_name,
+                    dimension=dimension,
+                    metric_type="COSINE",
+                    auto_id=True,
+                    enable_dynamic_field=True,
+                )
+            self._ready = True
+        return self._client
+
+    def get(self, question: str, fingerprint: str, version: str) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            vector = self.embeddings.embed_query(question)
+            results = self._collection(len(vector)).search(
+                self.collection_name,
+                data=[vector],
+                limit=1,
+                filter=(
+                    f'fingerprint == "{fingerprint}" and version == "{version}" '
+                    f"and expires_at > {int(time.time())}"
+                ),
+                output_fields=["answer"],
+            )
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {e}")
+            self._errors.inc()
+            self._misses.inc()
+            return None
+        finally:
+            self._latency.observe((time.perf_counter() - started) * 1000)
+
+        hits = results[0] if results else []
+        if hits:
+            self._similarity.observe(hits[0]["distance"])
+        if hits and hits[0]["distance"] >= self.threshold:
+            self._hits.inc()
+            return hits[0]["entity"]["answer"]
+        self._misses.inc()
+        return None
+
+    def put(self, question: str, fingerprint: str, version: str, answer: str):
+        now = int(time.time())
+        try:
+            vector = self.embeddings.embed_query(question)
+            client = self._collection(len(vector))
+            client.insert(
+                self.collection_name,
+                [
+                    {
+                        "vector": vector,
+                        "question": question,
+                        "fingerprint": fingerprint,
+                        "version": version,
+                        "answer": answer,
+                        "expires_at": now + int(self.ttl),
+                    }
+                ],
+            )
+            self._puts += 1
+            if self._puts % self.purge_every == 0:
+                client.delete(self.collection_name, filter=f"expires_at <= {now}")
+        except Exception as e:
+            print(f"Semantic cache insert failed: {e}")
+            self._errors.inc()
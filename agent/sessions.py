@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+from profiles import RenderedProfile
+
+if TYPE_CHECKING:
+    from langchain.memory import ConversationBufferMemory
+
+
+class Session:
+    """Conversation state owned by a single user/session id."""
+
+    def __init__(
+        self,
+        session_id: str,
+        memory: "ConversationBufferMemory",
+        conversation,
+        context_memory=None,
+        history=None,
+    ):
+        self.session_id = session_id
+        self.memory = memory
+        self.conversation = conversation
+        # Read-only memory that supplies retrieved label excerpts to the prompt.
+        self.context_memory = context_memory
+        # The memory's StoredChatHistory when histories live in a shared backend.
+        self.history = history
+        self.profile: Optional[RenderedProfile] = None
+        self.last_access = time.monotonic()
+        # Serializes turns of the same session; different sessions run in parallel.
+        self.lock = threading.Lock()
+
+    @asynccontextmanager
+    async def async_lock(self):
+        """Hold `lock` from a coroutine without blocking the event loop while waiting."""
+        # Contention only happens between turns of the same session, so polling is cheap
+        # and, unlike handing the blocking acquire to a thread, safe to cancel.
+        while not self.lock.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+        try:
+            yield
+        finally:
+            self.lock.release()
+
+    def size_bytes(self) -> int:
+        """Approximate the memory held by this session's history."""
+        summary = getattr(self.memory, "summary", "")
+        return len(summary.encode("utf-8")) + sum(
+            len(str(message.content).encode("utf-8"))
+            for message in self.memory.chat_memory.messages
+        )
+
+
+class SessionStore:
+    """Bounded LRU map of session id -> Session.
+
+    Sessions are evicted least-recently-used first when either the number of
+    sessions or the total history size exceeds its cap, and whenever a session
+    has been idle for longer than `idle_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Session],
+        max_sessions: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        idle_ttl: float = 3600.0,
+    ):
+        self._factory = factory
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Session:
+        """Return the session for `session_id`, creating it on a miss."""
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self.hits += 1
+                self._sessions.move_to_end(session_id)
+            else:
+                self.misses += 1
+                session = self._factory(session_id)
+                self._sessions[session_id] = session
+                self._sizes[session_id] = 0
+                self._enforce_limits(keep=session_id)
+            session.last_access = time.monotonic()
+            return session
+
+    def update(self, session: Session):
+        """Refresh the size accounting of a session after a turn and apply the caps."""
+        with self._lock:
+            if self._sessions.get(session.session_id) is not session:
+                return
+            size = session.size_bytes()
+            self._total_bytes += size - self._sizes[session.session_id]
+            self._sizes[session.session_id] = size
+            self._enforce_limits(keep=session.session_id)
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    # Callers must hold self._lock for the helpers below.
+    def _remove(self, session_id: str) -> bool:
+        if self._sessions.pop(session_id, None) is None:
+            return False
+        self._total_bytes -= self._sizes.pop(session_id, 0)
+        return True
+
+    def _evict_idle(self):
+        if self.idle_ttl <= 0:
+            return
+        deadline = time.monotonic() - self.idle_ttl
+        # The OrderedDict is kept in access order, so idle sessions sit at the front.
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > deadline:
+                break
+            self._remove(session_id)
+            self.evictions += 1
+
+    def _enforce_limits(self, keep: Optional[str] = None):
+        for session_id in list(self._sessions):
+            if (
+                len(self._sessions) <= self.max_sessions
+                and self._total_bytes <= self.max_bytes
+            ):
+                break
+            if session_id == keep:
+                continue
+            self._remove(session_id)
+            self.evictions += 1
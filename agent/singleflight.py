@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, Type
+
+from metrics import registry
+
+
+class LeaderCancelled(Exception):
+    """The call a follower was waiting for was cancelled before it finished."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Any = None
+
+
+class SingleFlight:
+    """Coalesce identical concurrent calls: followers wait for the leader's result.
+
+    Sync callers (threadpool handlers) and async callers (event-loop handlers)
+    are tracked separately; a call is only shared with callers of the same kind.
+    A leader's exception is re-raised in every follower, except cancellation:
+    if an async leader is cancelled, or a leader raises one of the `cancelled`
+    exception types, its followers start the call again.
+    """
+
+    def __init__(self, name: str = "llm", cancelled: Tuple[Type[BaseException], ...] = ()):
+        self.cancelled = cancelled
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._leaders = registry.counter(f"{name}_coalesce_leaders_total")
+        self._coalesced = registry.counter(f"{name}_coalesced_total")
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run `fn` unless an identical call is in flight; return (result, shared)."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+            call.done.wait()
+            if isinstance(call.error, LeaderCancelled):
+                continue
+            self._coalesced.inc()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        self._leaders.inc()
+        try:
+            call.result = fn()
+            return call.result, False
+        except self.cancelled:
+            call.error = LeaderCancelled()
+            raise
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Async variant of `do`; must be called from a single event loop."""
+        while key in self._futures:
+            try:
+                # Shield, so a cancelled follower does not cancel the leader's call.
+                result = await asyncio.shield(self._futures[key])
+            except LeaderCancelled:
+                continue
+            self._coalesced.inc()
+            return result, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        self._leaders.inc()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._futures[key]
+            # Retrieve any exception so asyncio does not log it when no follower waited.
+            future.exception()
@@ -0,0 +1,141 @@
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class NotReady(Exception):
+    """A request needed a resource that is still loading or failed to load."""
+
+
+class ImportProfiler:
+    """In-process equivalent of `python -X importtime`, for the startup report.
+
+    Wraps `__import__` and records, for every module imported for the first
+    time, its cumulative import time and its self time (excluding the modules it
+    imported in turn).
+    """
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._original = None
+        self._local = threading.local()
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = name
+        if level and name:
+            try:
+                module = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__"))
+            except (ImportError, ValueError):
+                module = ""
+        if not module or module in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self.records.append(
+                {
+                    "module": module,
+                    "self_ms": round((cumulative - children) * 1000, 2),
+                    "cumulative_ms": round(cumulative * 1000, 2),
+                    "depth": len(stack),
+                }
+            )
+
+    def top(self, limit: int = 25) -> List[Dict]:
+        return sorted(self.records, key=lambda r: r["cumulative_ms"], reverse=True)[:limit]
+
+
+class Warmup:
+    """Runs the named loading steps once, in order, and reports what is warm.
+
+    `start` runs them on a background thread; `wait` blocks until they are done
+    (running them in the caller if nobody started them) and raises NotReady if a
+    required step failed. A failed optional step is only reported.
+    """
+
+    def __init__(self):
+        self._steps: List = []
+        self.status: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._done = threading.Event()
+        self.failed: Optional[str] = None
+
+    def step(self, name: str, required: bool = True) -> Callable:
+        def register(fn: Callable[[], None]) -> Callable[[], None]:
+            self._steps.append((name, fn, required))
+            self.status[name] = {"state": "pending"}
+            return fn
+
+        return register
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self._started:
+                return False
+            self._started = True
+            return True
+
+    def start(self):
+        if self._claim():
+            threading.Thread(target=self._run, name="warmup", daemon=True).start()
+
+    def _run(self):
+        started_all = time.perf_counter()
+        try:
+            for name, fn, required in self._steps:
+                self.status[name] = {"state": "loading"}
+                started = time.perf_counter()
+                modules = len(sys.modules)
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"Warmup step {name} failed: {e}")
+                    self.status[name] = {"state": "failed", "error": str(e)}
+                    if required:
+                        self.failed = name
+                        return
+                    continue
+                self.status[name] = {
+                    "state": "ready",
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "modules_imported": len(sys.modules) - modules,
+                }
+            print(
+                f"Warmup done in {time.perf_counter() - started_all:.2f}s: "
+                + ", ".join(f"{name} {state.get('seconds')}s" for name, state in self.status.items())
+            )
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self.failed is None
+
+    def wait(self, timeout: Optional[float] = None):
+        if self._claim():
+            self._run()
+        if not self._done.wait(timeout):
+            raise NotReady("The assistant is still starting up.")
+        if self.failed is not None:
+            raise NotReady(f"Startup step {self.failed} failed.")
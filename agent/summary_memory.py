@@ -0,0 +1,152 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Dict, List, Tuple
+
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.prompts import BasePromptTemplate
+from langchain_core.runnables.config import run_in_executor
+from pydantic import PrivateAttr
+
+from prompt_budget import Tokenizer
+
+# Summaries are refreshed here so no chat request ever waits for one.
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+
+class RollingSummaryMemory(ConversationBufferMemory):
+    """Conversation memory that keeps the last `max_turns` turns verbatim.
+
+    Older turns are folded into a rolling summary by a background thread. Until
+    a refresh has finished, the turns it is folding stay in the history as they
+    were, so the model never loses context while the summary catches up. Turns
+    whose input is in `pinned_inputs` (the profile) are never summarized.
+
+    Turns are counted against `max_token_limit` with `tokenizer` (by default
+    one for the LLM's model). The summary call holds a slot of `admission`
+    when one is given, like any other call to the model.
+    """
+
+    llm: Any
+    tokenizer: Any = None
+    admission: Any = None
+    max_turns: int = 6
+    max_token_limit: int = 1500
+    pinned_inputs: Tuple[str, ...] = ("Profile",)
+    summary_prompt: BasePromptTemplate = SUMMARY_PROMPT
+    summary: str = ""
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _refreshing: bool = PrivateAttr(default=False)
+    _generation: int = PrivateAttr(default=0)
+
+    def _turns(self, messages: List[BaseMessage]) -> Tuple[List[BaseMessage], List[List[BaseMessage]]]:
+        """Split the stored messages into pinned messages and (human, ai) turns."""
+        pinned: List[BaseMessage] = []
+        turns: List[List[BaseMessage]] = []
+        for index in range(0, len(messages), 2):
+            turn = messages[index : index + 2]
+            if turn[0].content in self.pinned_inputs:
+                pinned.extend(turn)
+            else:
+                turns.append(turn)
+        return pinned, turns
+
+    @property
+    def buffer_as_messages(self) -> List[BaseMessage]:
+        messages = list(self.chat_memory.messages)
+        if not self.summary:
+            return messages
+        pinned, turns = self._turns(messages)
+        summary = SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")
+        return pinned + [summary] + [m for turn in turns for m in turn]
+
+    @property
+    def buffer_as_str(self) -> str:
+        return self._buffer_as_str(self.buffer_as_messages)
+
+    async def abuffer_as_messages(self) -> List[BaseMessage]:
+        return self.buffer_as_messages
+
+    async def abuffer_as_str(self) -> str:
+        return self.buffer_as_str
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        # Under the lock, so a fold that rewrites the messages cannot drop this turn.
+        with self._lock:
+            super().save_context(inputs, outputs)
+        self._schedule_refresh()
+
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        # The lock is a thread lock, so it is taken off the event loop.
+        await run_in_executor(None, self.save_context, inputs, outputs)
+
+    def clear(self) -> None:
+        with self._lock:
+            super().clear()
+            self.summary = ""
+            # A refresh started before the clear must not write its result back.
+            self._generation += 1
+
+    def _overflow(self) -> List[BaseMessage]:
+        """Return the oldest turns that no longer fit the turn or token budget."""
+        if self.tokenizer is None:
+            self.tokenizer = Tokenizer(self.llm.model_name)
+        _, turns = self._turns(list(self.chat_memory.messages))
+        overflow: List[BaseMessage] = []
+        while len(turns) > 1 and (
+            len(turns) > self.max_turns
+            or self.tokenizer.count(get_buffer_string([m for t in turns for m in t]))
+            > self.max_token_limit
+        ):
+            overflow.extend(turns.pop(0))
+        return overflow
+
+    def _schedule_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            overflow = self._overflow()
+            if not overflow:
+                return
+            self._refreshing = True
+            generation = self._generation
+        _summary_executor.submit(self._refresh, overflow, generation)
+
+    def _refresh(self, overflow: List[BaseMessage], generation: int):
+        try:
+            with self.admission.slot() if self.admission is not None else nullcontext():
+                result = self.llm.invoke(
+                    self.summary_prompt.format(
+                        summary=self.summary, new_lines=self._buffer_as_str(overflow)
+                    )
+                )
+            summary = getattr(result, "content", result).strip()
+        except Exception as e:
+            print(f"Error refreshing conversation summary: {e}")
+            with self._lock:
+                self._refreshing = False
+            return
+
+        with self._lock:
+            self._refreshing = False
+            if generation != self._generation:
+                return
+            fold = getattr(self.chat_memory, "fold", None)
+            if fold is not None:
+                # A shared history records the fold instead of rewriting its log.
+                try:
+                    fold(overflow, summary)
+                except Exception as e:
+                    print(f"Error saving conversation summary: {e}")
+                    return
+            else:
+                folded = {id(message) for message in overflow}
+                self.chat_memory.messages = [
+                    m for m in self.chat_memory.messages if id(m) not in folded
+                ]
+            self.summary = summary
+        # Turns that arrived while the summary was being written may need folding too.
+        self._schedule_refresh()
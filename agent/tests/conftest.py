@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# main.py reads its configuration at import time.
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("AGENT_RETRIEVAL", "0")
+os.environ.setdefault("AGENT_EMBEDDING_CACHE_DIR", tempfile.mkdtemp(prefix="agent-test-embeddings-"))
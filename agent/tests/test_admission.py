@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded, _Waiter
+
+
+def hold(controller: AdmissionController) -> threading.Event:
+    """Occupy one slot from a thread until the returned event is set."""
+    entered, release = threading.Event(), threading.Event()
+
+    def run():
+        with controller.slot():
+            entered.set()
+            release.wait(5)
+
+    threading.Thread(target=run, daemon=True).start()
+    assert entered.wait(5)
+    return release
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_full_queue_is_shed_with_retry_after():
+    import main
+
+    controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+    release = hold(controller)
+    queued = threading.Thread(target=lambda: controller.slot().__enter__(), daemon=True)
+    queued.start()
+    wait_until(lambda: controller.stats()["queued"] == 1)
+
+    with pytest.raises(Overloaded) as shed:
+        with controller.slot():
+            pass
+    assert shed.value.reason == "queue full"
+    assert shed.value.retry_after >= 1
+    response = main.overloaded_handler(None, shed.value)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(shed.value.retry_after)
+    release.set()
+
+
+def test_queue_timeout_leaves_the_queue():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    release = hold(controller)
+    started = time.monotonic()
+    with pytest.raises(Overloaded) as timed_out:
+        with controller.slot():
+            pass
+    assert timed_out.value.reason == "queue timeout"
+    assert time.monotonic() - started < 1
+    assert controller.stats()["queued"] == 0
+    release.set()
+    wait_until(lambda: controller.stats()["active"] == 0)
+
+
+def test_freed_slot_goes_to_the_oldest_waiter():
+    controller = AdmissionController(max_concurrent=1, max_queue=8, queue_timeout=5)
+    release = hold(controller)
+    order = []
+
+    def wait(index: int):
+        with controller.slot():
+            order.append(index)
+
+    threads = []
+    for index in range(4):
+        threads.append(threading.Thread(target=wait, args=(index,)))
+        threads[-1].start()
+        wait_until(lambda: controller.stats()["queued"] == index + 1)
+    # Arrives after the slot is freed but must not overtake the queue.
+    release.set()
+    wait(99)
+    for thread in threads:
+        thread.join(5)
+    assert order[:4] == [0, 1, 2, 3]
+    assert controller.stats() == {"active": 0, "queued": 0, "max_concurrent": 1, "max_queue": 8}
+
+
+def test_slot_granted_while_timing_out_is_returned():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=5)
+    holder, waiter = _Waiter(), _Waiter()
+    assert controller._enter(holder)
+    assert not controller._enter(waiter)
+    # The holder frees its slot, which is handed to the waiter just as it gives up.
+    controller._release(0.1)
+    assert waiter.admitted
+    controller._abandon(waiter)
+    assert controller.stats()["active"] == 0
+    with controller.slot():
+        assert controller.stats()["active"] == 1
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=5)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def holder():
+            async with controller.aslot():
+                await release.wait()
+
+        async def waiter():
+            async with controller.aslot():
+                pass
+
+        holding = asyncio.ensure_future(holder())
+        while controller.stats()["active"] == 0:
+            await asyncio.sleep(0.001)
+        waiting = asyncio.ensure_future(waiter())
+        while controller.stats()["queued"] == 0:
+            await asyncio.sleep(0.001)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert controller.stats()["queued"] == 0
+        release.set()
+        await holding
+
+    asyncio.run(scenario())
+    assert controller.stats()["active"] == 0
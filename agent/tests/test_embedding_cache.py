@@ -0,0 +1,77 @@
+import builtins
+import threading
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import embedding_cache
+from embedding_cache import CachedEmbeddings, EmbeddingStore, text_key
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls: List[List[str]] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0, 0.5] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_cached_texts_are_embedded_once(tmp_path):
+    provider = CountingEmbeddings()
+    embeddings = CachedEmbeddings.in_directory(provider, "model", str(tmp_path), window=0.05)
+    results = {}
+    threads = [
+        threading.Thread(target=lambda i=i: results.__setitem__(i, embeddings.embed_query(f"q{i % 4}")))
+        for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(len(call) for call in provider.calls) == 4
+    assert results[0] == [2.0, 1.0, 0.5]
+
+    reopened = CountingEmbeddings()
+    again = CachedEmbeddings.in_directory(reopened, "model", str(tmp_path))
+    assert again.embed_documents(["q0", "q3"]) == [[2.0, 1.0, 0.5], [2.0, 1.0, 0.5]]
+    assert reopened.calls == []
+
+
+def test_failed_key_write_leaves_files_aligned(tmp_path, monkeypatch):
+    store = EmbeddingStore(str(tmp_path))
+    a, b, c = (text_key("model", text) for text in "abc")
+    store.put_many({a: [1.0, 1.0]})
+
+    real_open = builtins.open
+
+    def failing_open(path, mode="r", *args, **kwargs):
+        if str(path).endswith("keys.float16") and "a" in mode:
+            raise OSError("disk full")
+        return real_open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(embedding_cache, "open", failing_open, raising=False)
+    with pytest.raises(OSError):
+        store.put_many({b: [2.0, 2.0]})
+    monkeypatch.undo()
+
+    store.put_many({c: [3.0, 3.0]})
+    assert store.get_many([a, b, c]) == {a: [1.0, 1.0], c: [3.0, 3.0]}
+    assert EmbeddingStore(str(tmp_path)).get_many([a, c]) == {a: [1.0, 1.0], c: [3.0, 3.0]}
+
+
+def test_rows_left_by_a_failed_append_are_overwritten(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    a, b = text_key("model", "a"), text_key("model", "b")
+    store.put_many({a: [1.0, 1.0]})
+    # Another process wrote a vector row and died before writing its key.
+    with open(tmp_path / "vectors.float16", "ab") as f:
+        f.write(b"\x00" * 4)
+
+    store.put_many({b: [2.0, 2.0]})
+    assert store.get_many([a, b]) == {a: [1.0, 1.0], b: [2.0, 2.0]}
+    assert EmbeddingStore(str(tmp_path)).get_many([a, b]) == {a: [1.0, 1.0], b: [2.0, 2.0]}
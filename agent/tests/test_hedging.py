@@ -0,0 +1,128 @@
+import socket
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+import httpx
+import pytest
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from hedging import HedgedLLM, Hedger
+from llm_transport import AbortScope, CircuitBreaker, RetryBudget, RetryPolicy, build_http_clients
+
+
+@pytest.fixture
+def silent_server():
+    """A server that accepts connections and never answers."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    accepted: List[socket.socket] = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}", accepted
+    server.close()
+    for conn in accepted:
+        conn.close()
+
+
+def client():
+    policy = RetryPolicy(RetryBudget(), CircuitBreaker(), base_delay=0.01)
+    return build_http_clients(policy, read_timeout=30.0)[0]
+
+
+def test_abort_unblocks_a_request_waiting_for_its_response(silent_server):
+    url, accepted = silent_server
+    http = client()
+    scope = AbortScope()
+    errors = []
+
+    def call():
+        with scope:
+            try:
+                http.get(url)
+            except httpx.HTTPError as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    time.sleep(0.2)
+    started = time.monotonic()
+    scope.abort()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert time.monotonic() - started < 2
+    assert len(errors) == 1
+    # Not retried: the one connection was the only one ever opened.
+    assert len(accepted) == 1
+
+
+class SilentThenFastLLM(LLM):
+    """The first call hangs on the silent server; the second streams at once."""
+
+    url: str
+    http: Any
+    calls: int = 0
+    finished: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "silent-then-fast"
+
+    @property
+    def model_name(self) -> str:
+        return "gpt-3.5-turbo-instruct"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        self.calls += 1
+        if self.calls == 1:
+            try:
+                self.http.get(self.url)
+            finally:
+                self.finished.append("primary")
+        yield GenerationChunk(text="fast")
+
+
+def test_losing_hedge_without_a_token_is_aborted(silent_server):
+    url, accepted = silent_server
+    inner = SilentThenFastLLM(url=url, http=client())
+    llm = HedgedLLM(llm=inner, hedger=Hedger(max_delay=0.1, budget=1.0))
+    assert llm.invoke("hi") == "fast"
+    deadline = time.monotonic() + 2
+    while not inner.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert inner.finished == ["primary"]
+    assert len(accepted) == 1
+
+
+class SlowFirstTokenLLM(LLM):
+    delay: float
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-first-token"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self.delay)
+        yield GenerationChunk(text="slow")
+        yield GenerationChunk(text=" answer")
+
+
+def test_refused_hedge_waits_for_the_first_token():
+    llm = HedgedLLM(llm=SlowFirstTokenLLM(delay=0.2), hedger=Hedger(max_delay=0.05, budget=0.0))
+    assert llm.invoke("hi") == "slow answer"
+    assert llm.hedger.stats()["recent_hedge_rate"] == 0.0
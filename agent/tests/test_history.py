@@ -0,0 +1,156 @@
+import threading
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from history import HistoryBackend, InMemoryHistory, PostgresHistory, StoredChatHistory
+
+
+def contents(history: StoredChatHistory):
+    return [message.content for message in history.messages]
+
+
+def replay(backend, session_id="s"):
+    history = StoredChatHistory(session_id, backend)
+    history.refresh()
+    return history
+
+
+def test_replay_follows_log_order():
+    backend = InMemoryHistory()
+    history = StoredChatHistory("s", backend)
+    history.add_messages([HumanMessage(content="q1"), AIMessage(content="a1")])
+    history.set_profile({"user_id": 7})
+    history.add_messages([HumanMessage(content="q2"), AIMessage(content="a2")])
+    history.fold(history.messages[:2], "asked q1")
+    history.add_messages([HumanMessage(content="q3"), AIMessage(content="a3")])
+
+    other = replay(backend)
+    assert contents(other) == ["q2", "a2", "q3", "a3"]
+    assert other.summary == "asked q1"
+    assert other.profile == {"user_id": 7}
+    assert other.seq == history.seq == 5
+
+    history.clear()
+    other.refresh()
+    assert other.messages == [] and other.summary == "" and other.profile is None
+
+
+class InterleavingHistory(InMemoryHistory):
+    """Lets another worker append right before the next append, after the caller's refresh."""
+
+    def __init__(self):
+        super().__init__()
+        self.before_append = None
+
+    def append(self, session_id, records):
+        hook, self.before_append = self.before_append, None
+        if hook is not None:
+            hook()
+        return super().append(session_id, records)
+
+
+def test_append_reads_records_appended_since_refresh():
+    backend = InterleavingHistory()
+    first = StoredChatHistory("s", backend)
+    second = StoredChatHistory("s", backend)
+    first.add_messages([HumanMessage(content="q1")])
+
+    backend.before_append = lambda: second.add_messages([HumanMessage(content="from second")])
+    first.add_messages([HumanMessage(content="q2")])
+
+    assert contents(first) == ["q1", "from second", "q2"]
+    first.refresh()
+    assert contents(first) == contents(replay(backend))
+
+
+def test_concurrent_appends_from_two_histories_converge():
+    backend = InMemoryHistory()
+    histories = [StoredChatHistory("s", backend), StoredChatHistory("s", backend)]
+
+    def write(history, name):
+        for index in range(200):
+            history.add_messages([HumanMessage(content=f"{name}{index}")])
+
+    threads = [threading.Thread(target=write, args=(h, name)) for h, name in zip(histories, "ab")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expected = contents(replay(backend))
+    assert len(expected) == 400
+    for history in histories:
+        history.refresh()
+        assert contents(history) == expected
+
+
+class FakeCursor:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def execute(self, query, params):
+        self.pool.executions += 1
+        if self.pool.conflicts:
+            self.pool.conflicts -= 1
+            raise self.pool.errors.UniqueViolation("duplicate key value violates unique constraint")
+
+    def fetchall(self):
+        return [(4,), (5,)]
+
+
+class FakeConnection:
+    closed = 0
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.autocommit = False
+
+    def cursor(self):
+        return FakeCursor(self.pool)
+
+
+class FakePool:
+    def __init__(self, errors, conflicts):
+        self.errors = errors
+        self.conflicts = conflicts
+        self.executions = 0
+        self.returned = 0
+
+    def getconn(self):
+        return FakeConnection(self)
+
+    def putconn(self, conn, close=False):
+        self.returned += 1
+
+
+def postgres_history(conflicts):
+    errors = pytest.importorskip("psycopg2.errors")
+    history = PostgresHistory.__new__(PostgresHistory)
+    history.table = "agent_chat_history"
+    history._pool = FakePool(errors, conflicts)
+    return history
+
+
+def test_postgres_append_retries_on_unique_violation():
+    history = postgres_history(conflicts=2)
+    assert history.append("s", [{"type": "clear"}, {"type": "clear"}]) == 5
+    assert history._pool.executions == 3
+    assert history._pool.returned == 3
+
+
+def test_postgres_append_gives_up_after_attempts():
+    errors = pytest.importorskip("psycopg2.errors")
+    history = postgres_history(conflicts=10)
+    with pytest.raises(errors.UniqueViolation):
+        history.append("s", [{"type": "clear"}], attempts=3)
+    assert history._pool.executions == 3
+
+
+def test_incomplete_backend_cannot_be_created():
+    class ReadOnly(HistoryBackend):
+        def read(self, after):
+            return {}
+
+    with pytest.raises(TypeError):
+        ReadOnly()
@@ -0,0 +1,73 @@
+import glob
+import os
+import threading
+
+import history_log
+from history import snapshot
+from history_log import LogHistory
+
+
+def turn(index):
+    return {"type": "messages", "messages": [{"type": "human", "data": {"content": f"q{index}"}}]}
+
+
+def messages(backend, session_id):
+    records = [record for _, record in backend.read({session_id: 0})[session_id]]
+    return [message["data"]["content"] for message in snapshot(records)["messages"]]
+
+
+def test_appends_proceed_and_survive_while_a_shard_compacts(tmp_path, monkeypatch):
+    backend = LogHistory(str(tmp_path), shards=1, fsync=False, compact_bytes=1 << 40)
+    for index in range(20):
+        backend.append("a", [turn(index)])
+    shard = backend._shards[0]
+
+    appended = []
+    real_snapshot = history_log.snapshot
+
+    def snapshot_while_appending(records):
+        if not appended:
+            # Runs in the middle of the rewrite; it must not wait for the compaction.
+            writer = threading.Thread(target=lambda: appended.append(backend.append("a", [turn(20)])))
+            writer.start()
+            writer.join(2)
+            assert appended, "append blocked by compaction"
+            backend.append("b", [turn(0)])
+        return real_snapshot(records)
+
+    monkeypatch.setattr(history_log, "snapshot", snapshot_while_appending)
+    shard.compact()
+
+    assert appended == [21]
+    assert shard.generation == 1
+    assert messages(backend, "a") == [f"q{index}" for index in range(21)]
+    assert messages(backend, "b") == ["q0"]
+    assert backend.append("a", [turn(21)]) == 22
+    backend.close()
+
+    reopened = LogHistory(str(tmp_path), shards=1, fsync=False, compact_bytes=1 << 40)
+    assert messages(reopened, "a") == [f"q{index}" for index in range(22)]
+    assert messages(reopened, "b") == ["q0"]
+    assert sorted(os.path.basename(path) for path in glob.glob(str(tmp_path / "shard-000.*"))) == [
+        "shard-000.1.idx",
+        "shard-000.1.log",
+    ]
+    reopened.close()
+
+
+def test_unfinished_compaction_is_discarded_on_open(tmp_path):
+    backend = LogHistory(str(tmp_path), shards=1, fsync=False, compact_bytes=1 << 40)
+    for index in range(5):
+        backend.append("a", [turn(index)])
+    backend.close()
+    # What a compaction leaves behind when it crashes before switching generations.
+    (tmp_path / "shard-000.1.log.tmp").write_bytes(b"partial")
+    (tmp_path / "shard-000.1.idx").write_bytes(b"stale")
+
+    reopened = LogHistory(str(tmp_path), shards=1, fsync=False, compact_bytes=1 << 40)
+    assert messages(reopened, "a") == [f"q{index}" for index in range(5)]
+    assert sorted(os.path.basename(path) for path in glob.glob(str(tmp_path / "shard-000.*"))) == [
+        "shard-000.0.idx",
+        "shard-000.0.log",
+    ]
+    reopened.close()
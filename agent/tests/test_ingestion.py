@@ -0,0 +1,68 @@
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+from ingestion import LabelIngestor
+
+
+class FakeMilvus:
+    """The parts of langchain_milvus.Milvus that ingestion uses, counting embedded texts."""
+
+    collection_name = "labels"
+    _primary_field = "pk"
+
+    def __init__(self):
+        self.rows: Dict[str, Document] = {}
+        self.embedded = 0
+        self.client = self
+
+    @property
+    def col(self):
+        return self if self.rows else None
+
+    @property
+    def num_entities(self) -> int:
+        return len(self.rows)
+
+    def query(self, collection_name: str, filter: str, output_fields: List[str]) -> List[Dict]:
+        return [{"pk": pk, **doc.metadata} for pk, doc in self.rows.items() if filter == f'source == "{doc.metadata["source"]}"']
+
+    def add_documents(self, documents: List[Document], ids: List[str]):
+        self.embedded += len(documents)
+        self.rows.update(zip(ids, documents))
+
+    def upsert(self, ids: List[str], documents: List[Document]):
+        self.rows.update(zip(ids, documents))
+
+    def delete(self, ids: List[str]):
+        for pk in ids:
+            del self.rows[pk]
+
+
+PAGES = [f"Page {n}: " + " ".join(f"word{n}-{i}" for i in range(40)) for n in range(1, 6)]
+
+
+def test_inserting_a_page_only_moves_the_chunks_after_it():
+    store = FakeMilvus()
+    ingestor = LabelIngestor(store, None, chunk_size=200, chunk_overlap=0)
+    first = ingestor.sync("label.pdf", PAGES)
+    assert first.added == store.embedded and first.deleted == 0
+
+    result = ingestor.sync("label.pdf", PAGES[:2] + ["A new page about dosing."] + PAGES[2:])
+    assert (result.added, result.deleted) == (1, 0)
+    assert result.moved == first.added - sum(1 for doc in store.rows.values() if doc.metadata["page"] <= 2)
+    assert store.embedded == first.added + 1
+    pages = {doc.page_content: doc.metadata["page"] for doc in store.rows.values()}
+    assert all(pages[text] == 4 for text in pages if text.startswith("Page 3"))
+
+
+def test_changed_page_replaces_only_its_chunks():
+    store = FakeMilvus()
+    ingestor = LabelIngestor(store, None, chunk_size=200, chunk_overlap=0)
+    ingestor.sync("label.pdf", PAGES)
+    before = store.embedded
+    last_page = sum(1 for doc in store.rows.values() if doc.metadata["page"] == 5)
+
+    result = ingestor.sync("label.pdf", PAGES[:4] + ["Page 5 was rewritten."])
+    assert (result.added, result.deleted, result.moved) == (1, last_page, 0)
+    assert store.embedded == before + 1
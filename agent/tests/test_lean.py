@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from langchain.memory import ConversationBufferMemory
+
+from lean import BufferMemory
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+@pytest.mark.parametrize("return_messages", [True, False])
+def test_buffer_memory_matches_conversation_buffer_memory(return_messages):
+    lean = BufferMemory(return_messages=return_messages, input_key="input")
+    chain = ConversationBufferMemory(return_messages=return_messages, input_key="input")
+    for memory in (lean, chain):
+        memory.save_context({"input": "Profile"}, {"output": "My name is Ann."})
+        memory.save_context({"input": "How often?", "history": "ignored"}, {"response": "Once daily."})
+    assert lean.load_memory_variables({}) == chain.load_memory_variables({})
+    lean.clear()
+    assert lean.chat_memory.messages == []
+
+
+def test_lean_sessions_do_not_import_langchain_chains():
+    script = (
+        "import sys, main\n"
+        "main.warmup.wait()\n"
+        "main.create_session('lean', persistent=False)\n"
+        "print('langchain.chains' in sys.modules)\n"
+    )
+    env = dict(os.environ, AGENT_EXECUTION="lean", AGENT_MEMORY_MODE="buffer")
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=AGENT_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "False"
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+from typing import Iterator, List
+
+import httpx
+import pytest
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+import main
+
+
+@pytest.fixture(scope="module")
+def warm():
+    main.warmup.start()
+    main.warmup.wait()
+    return main
+
+
+def test_llm_requests_carry_configured_timeout(warm, monkeypatch):
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        raise httpx.ConnectError("offline", request=request)
+
+    monkeypatch.setattr(main.http_client, "_transport", httpx.MockTransport(handler))
+    with pytest.raises(Exception):
+        main.llm.invoke("hi")
+    with pytest.raises(Exception):
+        main.embeddings.embeddings.client.create(input=[[1, 2, 3]], model=main.EMBEDDING_MODEL)
+
+    assert len(requests) == 2
+    for request in requests:
+        timeout = request.extensions["timeout"]
+        assert timeout["connect"] == main.LLM_CONNECT_TIMEOUT
+        assert timeout["read"] == main.LLM_READ_TIMEOUT
+
+
+class SlowStreamingLLM(LLM):
+    """Streams `tokens` with `delay` seconds before each, like a slow upstream."""
+
+    tokens: List[str]
+    delay: float
+    model_name: str = "gpt-3.5-turbo-instruct"
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow"
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
+        return "".join(self.tokens)
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs) -> Iterator[GenerationChunk]:
+        for token in self.tokens:
+            time.sleep(self.delay)
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token)
+            yield GenerationChunk(text=token)
+
+
+class ConnectedRequest:
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+def test_stream_cancelled_while_generating_is_torn_down(warm, monkeypatch):
+    monkeypatch.setattr(main, "llm", SlowStreamingLLM(tokens=["Take", " it", " once", " daily", "."], delay=0.2))
+    chat_request = main.ChatRequest(user_input="How do I take it?", session_id="stream-cancel")
+    response = main.chat_stream_endpoint(chat_request, ConnectedRequest())
+    events = []
+
+    async def disconnect_mid_token():
+        async def consume():
+            async for event in response.body_iterator:
+                events.append(event)
+
+        task = asyncio.ensure_future(consume())
+        while not events:
+            await asyncio.sleep(0.01)
+        # The worker thread is now waiting for the next token inside the generator.
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    started = time.monotonic()
+    asyncio.run(disconnect_mid_token())
+    assert time.monotonic() - started < 0.6
+
+    assert len(events) == 1
+    session = main.session_store.get("stream-cancel")
+    assert session.lock.acquire(blocking=False)
+    session.lock.release()
+    # The aborted turn is not saved.
+    assert session.memory.chat_memory.messages == []
+
+
+class RecordingLLM(FakeListLLM):
+    prompts: List[str] = []
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
+        self.prompts.append(prompt)
+        return super()._call(prompt, stop, run_manager, **kwargs)
+
+
+def test_anonymous_requests_do_not_share_a_session(warm, monkeypatch):
+    llm = RecordingLLM(responses=["Noted."], prompts=[])
+    monkeypatch.setattr(main, "llm", llm)
+    assert main.resolve_session_id(main.ChatRequest(user_input="hi")) is None
+    first = main.request_session(main.ChatRequest(user_input="hi"))
+    second = main.request_session(main.ChatRequest(user_input="hi"))
+    assert first is not second
+
+    stored = len(main.session_store)
+    cancel = main.CancellationHandler()
+    main.chat_turn(main.ChatRequest(user_input="My name is Alice."), cancel)
+    main.chat_turn(main.ChatRequest(user_input="What is my name?"), cancel)
+    assert len(llm.prompts) == 2
+    assert "Alice" not in llm.prompts[1]
+    assert len(main.session_store) == stored
+
+
+def test_requests_with_an_id_keep_their_session(warm):
+    by_session = main.ChatRequest(user_input="hi", session_id="abc")
+    by_profile = main.ChatRequest(user_input="hi", profile={"user_id": 7})
+    assert main.request_session(by_session) is main.request_session(by_session)
+    assert main.resolve_session_id(by_profile) == "user:7"
+
+
+def test_history_database_connection_is_retried(monkeypatch):
+    psycopg2 = pytest.importorskip("psycopg2")
+    import history
+
+    attempts = []
+    delays = []
+
+    class StartingDatabase:
+        def __init__(self, *args, **kwargs):
+            attempts.append(kwargs)
+            if len(attempts) < 3:
+                raise psycopg2.OperationalError("connection refused")
+
+    monkeypatch.setattr(history, "PostgresHistory", StartingDatabase)
+    monkeypatch.setattr(main.time, "sleep", delays.append)
+    assert isinstance(main.connect_postgres_history(), StartingDatabase)
+    assert delays == [0.5, 1.0]
+
+    attempts.clear()
+    monkeypatch.setattr(main, "HISTORY_CONNECT_TIMEOUT", 0.0)
+    with pytest.raises(psycopg2.OperationalError):
+        main.connect_postgres_history()
+    assert len(attempts) == 1
+
+
+def test_batch_item_whose_session_cannot_be_created_reports_an_error(warm, monkeypatch):
+    monkeypatch.setattr(main, "llm", FakeListLLM(responses=["Once daily."]))
+    create_session = main.create_session
+
+    def failing(session_id: str, persistent: bool = True):
+        if session_id == "batch:0":
+            raise ValueError("no prompt")
+        return create_session(session_id, persistent)
+
+    monkeypatch.setattr(main, "create_session", failing)
+    batch = main.BatchRequest(items=[main.BatchItem(user_input="How often?", id=str(i)) for i in range(2)])
+    response = asyncio.run(main.chat_batch_endpoint(batch))
+
+    async def collect():
+        return [json.loads(line) async for line in response.body_iterator]
+
+    lines = sorted(asyncio.run(asyncio.wait_for(collect(), 5)), key=lambda line: line["index"])
+    assert lines[0]["error"] == "failed"
+    assert lines[1]["response"] == "Once daily."
@@ -0,0 +1,81 @@
+import pytest
+
+from safety import SafetyMatcher, load_keywords, load_matcher
+
+# The keyword lists and substring checks main.py used before the matcher existed.
+BASELINE = {
+    "emergency": ["emergency", "chest pain", "severe", "unconscious", "difficulty breathing", "shortness of breath"],
+    "sensitive": ["suicide", "self-harm", "harm myself", "i feel hopeless"],
+    "uncertain": ["i'm not sure", "uncertain", "i don't have enough information"],
+}
+
+TEXTS = [
+    "I have chest pains since this morning",
+    "CHEST PAIN after my first dose",
+    "I've been self-harming again",
+    "Is this one of those emergencies?",
+    "There is some uncertainty about the dose",
+    "Severely dizzy and short of breath",
+    "my friend is unconscious",
+    "Difficulty breathing at night",
+    "I want to harm myself",
+    "I feel hopeless lately",
+    "suicidehotline number?",
+    "I’m not sure that is right",
+    "I don't have enough information to answer.",
+    "nonemergency question about statins",
+    "Take one tablet daily with water.",
+    "What is the usual dose of rosuvastatin?",
+    "",
+]
+
+
+def baseline_match(text):
+    return {category for category, terms in BASELINE.items() if any(term in text.lower() for term in terms)}
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_matcher_flags_everything_the_substring_scan_flagged(text):
+    assert baseline_match(text) <= SafetyMatcher(BASELINE).match(text)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_shipped_keywords_cover_the_old_lists(text):
+    assert baseline_match(text) <= load_matcher().match(text)
+
+
+def test_shipped_keywords_contain_the_old_lists():
+    shipped = load_keywords()
+    for category, terms in BASELINE.items():
+        assert set(terms) <= set(shipped[category])
+
+
+@pytest.mark.parametrize(
+    "text, category",
+    [
+        ("I have chest pains", "emergency"),
+        ("is this an emergency?", "emergency"),
+        ("these emergencies scare me", "emergency"),
+        ("I'm short of breath", "emergency"),
+        ("I've been self-harming again", "sensitive"),
+        ("I have been self harming", "sensitive"),
+        ("I feel suicidal", "sensitive"),
+        ("I keep hurting myself", "sensitive"),
+        ("There is some uncertainty here", "uncertain"),
+        ("I am not sure about that", "uncertain"),
+    ],
+)
+def test_inflected_forms_match(text, category):
+    assert load_matcher().matches(text, category)
+
+
+def test_every_category_and_nested_term_is_reported():
+    matcher = SafetyMatcher({"a": ["harm myself"], "b": ["harm"], "c": ["myself"], "d": ["chest pain"]})
+    assert matcher.match("I might harm myself, chest pain too") == {"a", "b", "c", "d"}
+    assert matcher.match("nothing to see") == set()
+
+
+def test_plain_questions_do_not_match():
+    matcher = load_matcher()
+    for text in ["What is the usual dose of rosuvastatin?", "Can I take Crestor with food?"]:
+        assert matcher.match(text) == set()
@@ -0,0 +1,55 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lean import BufferMemory
+from sessions import Session, SessionStore
+
+
+def new_session(session_id: str) -> Session:
+    return Session(session_id, BufferMemory(return_messages=True), conversation=None)
+
+
+def say(store: SessionStore, session_id: str, text: str):
+    session = store.get(session_id)
+    session.memory.chat_memory.add_messages([HumanMessage(content=text), AIMessage(content=text)])
+    store.update(session)
+
+
+def test_least_recently_used_session_is_evicted_by_count():
+    store = SessionStore(new_session, max_sessions=2, idle_ttl=0)
+    first = store.get("a")
+    store.get("b")
+    assert store.get("a") is first
+    store.get("c")
+    assert len(store) == 2
+    # "b" was used least recently, so "a" survived.
+    assert store.get("a") is first
+    assert store.stats()["evictions"] == 1
+    assert (store.hits, store.misses) == (2, 3)
+
+
+def test_sessions_are_evicted_by_total_history_size():
+    store = SessionStore(new_session, max_bytes=100, idle_ttl=0)
+    say(store, "a", "x" * 20)
+    say(store, "b", "y" * 20)
+    assert len(store) == 2 and store.stats()["bytes"] == 80
+    say(store, "a", "z" * 15)
+    # Over the cap: "b", used least recently, goes.
+    assert list(store._sessions) == ["a"]
+    assert store.stats()["bytes"] == 70
+    assert store.stats()["evictions"] == 1
+    # The session being updated is kept even when it alone is over the cap.
+    say(store, "a", "w" * 20)
+    assert len(store) == 1 and store.stats()["bytes"] == 110
+
+
+def test_idle_sessions_expire():
+    store = SessionStore(new_session, idle_ttl=10)
+    idle = store.get("idle")
+    say(store, "idle", "hello")
+    store.get("busy")
+    idle.last_access -= 60
+    store.get("busy")
+    assert len(store) == 1
+    assert store.stats()["bytes"] == 0
+    assert store.get("idle") is not idle
+    assert store.stats()["evictions"] == 1
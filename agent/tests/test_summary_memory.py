@@ -0,0 +1,91 @@
+import threading
+import time
+
+from langchain_core.language_models.fake import FakeListLLM
+
+from admission import AdmissionController
+from prompt_budget import Tokenizer
+from summary_memory import RollingSummaryMemory
+
+
+class BlockingLLM(FakeListLLM):
+    """Summarizes only once `release` is set; fails if asked to count tokens itself."""
+
+    release: threading.Event
+    started: threading.Event
+    admission: AdmissionController = None
+    active_slots: list = []
+
+    def get_num_tokens(self, text: str) -> int:
+        raise ImportError("no tokenizer for this model")
+
+    def invoke(self, *args, **kwargs):
+        self.started.set()
+        if self.admission is not None:
+            self.active_slots.append(self.admission.stats()["active"])
+        self.release.wait(5)
+        return super().invoke(*args, **kwargs)
+
+
+def make_memory(**kwargs):
+    llm = BlockingLLM(responses=["They asked about doses."], release=threading.Event(), started=threading.Event())
+    memory = RollingSummaryMemory(
+        llm=llm, max_turns=2, return_messages=True, input_key="input", tokenizer=Tokenizer(), **kwargs
+    )
+    return memory, llm
+
+
+def wait_for_refresh(memory):
+    deadline = time.monotonic() + 5
+    while memory._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def save_turn(memory, index):
+    memory.save_context({"input": f"q{index}"}, {"response": f"a{index}"})
+
+
+def test_turn_saved_during_a_fold_is_kept():
+    memory, llm = make_memory()
+    for index in range(3):
+        save_turn(memory, index)
+    assert llm.started.wait(5)
+
+    # Save a turn while the summary is written back.
+    with memory._lock:
+        saver = threading.Thread(target=save_turn, args=(memory, 3))
+        saver.start()
+        time.sleep(0.05)
+        assert saver.is_alive()
+        llm.release.set()
+    saver.join(5)
+    wait_for_refresh(memory)
+
+    contents = [message.content for message in memory.chat_memory.messages]
+    assert contents[-2:] == ["q3", "a3"]
+    assert "q0" not in contents
+    assert memory.summary == "They asked about doses."
+
+
+def test_overflow_counts_tokens_without_the_llm_tokenizer():
+    memory, llm = make_memory()
+    memory.max_turns = 100
+    memory.max_token_limit = 10
+    llm.release.set()
+    for index in range(3):
+        memory.save_context({"input": "question " * 10}, {"response": f"a{index}"})
+    wait_for_refresh(memory)
+    assert memory.summary == "They asked about doses."
+
+
+def test_summary_call_holds_an_admission_slot():
+    admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=1)
+    memory, llm = make_memory(admission=admission)
+    llm.admission = admission
+    llm.active_slots = []
+    llm.release.set()
+    for index in range(3):
+        save_turn(memory, index)
+    wait_for_refresh(memory)
+    assert llm.active_slots == [1]
+    assert admission.stats()["active"] == 0